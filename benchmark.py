@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+###
+# Copyright (c) 2013-2014, spline
+# All rights reserved.
+#
+#
+###
+"""
+Benchmark checkfootball over a full NFL Sunday.
+
+Builds a synthetic 16 game slate (scoring drives, redzones, big plays,
+halftimes, finals and an overtime) in the format ReplaySource reads, or
+uses a directory recorded with the recordDir setting. It then drives
+Football._tick tick by tick against a fake irc, stepping the replay
+clock by whatever interval the plugin schedules. Per-tick wall time,
+feed fetches, bytes fetched, messages sent and peak memory are reported
+and compared against stored baselines.
+
+Fetches, bytes, messages, ticks and errors are deterministic for the
+synthetic slate, so their baseline (benchmark_baseline.json) is committed.
+Timings and memory depend on the machine and go in benchmark_timings.json,
+which is not.
+
+Run it from the plugin directory with Limnoria installed:
+
+    python benchmark.py                  # run and compare with the baselines.
+    python benchmark.py --save-baseline  # run and store the baselines.
+    python benchmark.py --replay DIR -v  # use a real recording, print every tick.
+"""
+
+import os
+import sys
+import json
+import atexit
+import time
+import random
+import shutil
+import resource
+import tempfile
+import datetime
+import optparse
+from calendar import timegm
+import pytz
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+TIMINGS = os.path.join(HERE, 'benchmark_timings.json')
+COUNTS = ('ticks', 'fetches', 'bytes', 'messages', 'errors')
+
+# 16 games. (away, home, kickoff in 12hr eastern).
+SLATE = [('MIA', 'BUF', '1:00'), ('NE', 'MIN', '1:00'), ('ATL', 'CIN', '1:00'), ('NO', 'CLE', '1:00'),
+         ('DET', 'CAR', '1:00'), ('ARI', 'NYG', '1:00'), ('DAL', 'TEN', '1:00'), ('JAC', 'WAS', '1:00'),
+         ('SEA', 'SD', '4:05'), ('STL', 'TB', '4:05'), ('HOU', 'OAK', '4:25'), ('NYJ', 'GB', '4:25'),
+         ('KC', 'DEN', '4:25'), ('PIT', 'BAL', '4:25'), ('CHI', 'SF', '8:30'), ('PHI', 'IND', '8:30')]
+DATE = '20140914'
+
+#####################
+# SYNTHETIC SUNDAY  #
+#####################
+
+def _kickoff(t):
+    naive = datetime.datetime.strptime("{0} {1} PM".format(DATE, t), "%Y%m%d %I:%M %p")
+    return timegm(pytz.timezone("US/Eastern").localize(naive).astimezone(pytz.UTC).utctimetuple())
+
+def _status(minute, ot, final):
+    """(q, seconds on the clock) for a game this many minutes after kickoff.
+    Quarters take 40 minutes and halftime 15."""
+
+    for (q, start, length, clock) in (('1', 0, 40, 900), ('2', 40, 40, 900), ('H', 80, 15, None),
+                                      ('3', 95, 40, 900), ('4', 135, 40, 900)):
+        if start <= minute < start + length:
+            return (q, None if clock is None else int(clock * (1 - (minute - start) / float(length))))
+    if ot and minute < final:
+        return ('5', int(600 * (1 - (minute - 175) / 15.0)))
+    return ('FO' if ot else 'F', None)
+
+def _events(rng, i, away, home):
+    """Scoring plays for a game as (minute, team, type, points)."""
+
+    if i == 0:  # tied after regulation, decided in overtime.
+        return [(20, away, 'TD', 7), (100, home, 'TD', 7), (150, away, 'FG', 3), (170, home, 'FG', 3), (182, home, 'FG', 3)]
+    minutes = [m for m in range(2, 175) if not 78 <= m < 97]
+    events = []
+    for m in sorted(rng.sample(minutes, rng.randint(5, 9))):
+        if rng.random() < 0.6:
+            events.append((m, rng.choice((away, home)), 'TD', 7))
+        else:
+            events.append((m, rng.choice((away, home)), 'FG', 3))
+    scores = dict((t, sum([e[3] for e in events if e[1] == t])) for t in (away, home))
+    if scores[away] == scores[home]:  # no overtime for anyone else.
+        events.append((173, home, 'FG', 3))
+    return events
+
+def _stats(rng, team):
+    players = lambda n: dict(("00-{0}{1}".format(team, j), n(j)) for j in range(3))
+    return {'abbr': team, 'stats': {
+        'passing': players(lambda j: {'name': "{0} QB{1}".format(team, j), 'cmp': rng.randint(1, 30), 'att': 35, 'tds': rng.randint(0, 3), 'ints': rng.randint(0, 2), 'yds': rng.randint(10, 350)}),
+        'rushing': players(lambda j: {'name': "{0} RB{1}".format(team, j), 'yds': rng.randint(0, 150), 'att': rng.randint(1, 25), 'tds': rng.randint(0, 2)}),
+        'receiving': players(lambda j: {'name': "{0} WR{1}".format(team, j), 'yds': rng.randint(0, 150), 'tds': rng.randint(0, 2)}),
+        'team': {'trnovr': rng.randint(0, 4), 'totyds': rng.randint(200, 500), 'totfd': rng.randint(10, 30), 'top': "{0}:{1:02d}".format(rng.randint(25, 35), rng.randint(0, 59))}}}
+
+def buildslate(directory, teamnames, seed=1):
+    """Write a synthetic Sunday into directory in ReplaySource format."""
+
+    rng = random.Random(seed)
+    index = []
+    def record(t, kind, key, body):
+        fn = "{0:07d}-{1}{2}".format(len(index), kind, "-{0}".format(key) if key else "")
+        with open(os.path.join(directory, fn), 'wb') as f:
+            f.write(body)
+        index.append({'t': t, 'kind': kind, 'key': key, 'file': fn})
+    games = []
+    for (i, (away, home, t)) in enumerate(SLATE):
+        events = _events(rng, i, away, home)
+        games.append({'eid': "{0}{1:02d}".format(DATE, i), 'away': away, 'home': home, 't': t, 'start': _kickoff(t), 'events': events,
+                      'ot': i == 0, 'final': 190 if i == 0 else 175, 'stats': {'away': _stats(rng, away), 'home': _stats(rng, home)},
+                      'bigplays': [(m - 3, team) for (m, team, typ, pts) in events if typ == 'TD' and m > 3]})
+    origin = min([g['start'] for g in games]) - 600
+    end = max([g['start'] for g in games]) + 200 * 60
+    # odds, once up front. a half line in there too, like the real feed.
+    odds = []
+    for g in games:
+        for period in ('1st Half', 'Game'):
+            odds.append("<event><participant><participant_name>{0}</participant_name><odds><moneyline>-150</moneyline></odds></participant>"
+                        "<participant><participant_name>{1}</participant_name><odds><moneyline>130</moneyline></odds></participant>"
+                        "<period><period_description>{2}</period_description><spread><spread_home>3</spread_home></spread>"
+                        "<total><total_points>44.5</total_points></total></period></event>".format(teamnames[g['away']], teamnames[g['home']], period))
+    record(origin, 'odds', None, "<events>{0}</events>".format("".join(odds)))
+    # scorestrip every minute (only when it changes) and game-center docs whenever a game's summary changes.
+    (laststrip, lastgtd) = (None, {})
+    for now in range(origin, end, 60):
+        gms = []
+        bps = []
+        for g in games:
+            minute = (now - g['start']) // 60
+            if minute < 0:
+                (q, secs) = ('P', None)
+            else:
+                (q, secs) = _status(minute, g['ot'], g['final'])
+            done = [e for e in g['events'] if e[0] <= minute]
+            vs = sum([e[3] for e in done if e[1] == g['away']])
+            hs = sum([e[3] for e in done if e[1] == g['home']])
+            # redzone for the two minutes before a TD.
+            drive = [e for e in g['events'] if e[2] == 'TD' and e[0] - 2 <= minute < e[0]]
+            attrs = 'eid="{0}" gsis="{1}" d="Sun" t="{2}" q="{3}" h="{4}" hnn="" hs="{5}" v="{6}" vnn="" vs="{7}" rz="{8}" ga="" gt="REG"'.format(
+                g['eid'], 56000 + int(g['eid'][-2:]), g['t'], q, g['home'], hs, g['away'], vs, "1" if drive else "0")
+            if secs is not None:
+                attrs += ' k="{0}:{1:02d}"'.format(secs // 60, secs % 60)
+            if drive:
+                attrs += ' p="{0}"'.format(drive[0][1])
+            gms.append("<g {0}/>".format(attrs))
+            for (j, (m, team)) in enumerate(g['bigplays']):
+                if m <= minute:
+                    bps.append('<b id="{0}{1}" eid="{0}" abbr="{2}" x="{2} - 45 yd pass"/>'.format(g['eid'], j, team))
+            # game-center doc. TDs show up before the PAT does.
+            if minute >= 0:
+                summary = {}
+                for (j, (m, team, typ, pts)) in enumerate(done):
+                    desc = "{0} scoring play {1}".format(team, j + 1)
+                    if typ == 'TD' and minute > m:
+                        desc += " (kick is good)"
+                    summary[str(j + 1)] = {'team': team, 'type': typ, 'desc': desc, 'qtr': 1}
+                doc = dict(g['stats'])
+                doc['scrsummary'] = summary
+                body = json.dumps({g['eid']: doc})
+                if lastgtd.get(g['eid']) != body:
+                    record(now, 'gtd', g['eid'], body)
+                    lastgtd[g['eid']] = body
+        strip = '<ss><gms w="2" y="2014" t="REG">{0}</gms><bps>{1}</bps></ss>'.format("".join(gms), "".join(bps))
+        if strip != laststrip:
+            record(now, 'scorestrip', None, strip)
+            laststrip = strip
+    with open(os.path.join(directory, 'index.jsonl'), 'w') as f:
+        for e in index:
+            f.write(json.dumps(e) + "\n")
+    return directory
+
+#############
+# HARNESS   #
+#############
+
+class FakeState(object):
+    def __init__(self, channels):
+        self.channels = dict((c, None) for c in channels)
+
+class FakeIrc(object):
+    """Just enough irc for the plugin. Counts what it is asked to send."""
+
+    def __init__(self, channels):
+        self.state = FakeState(channels)
+        self.sent = 0
+
+    def queueMsg(self, msg):
+        self.sent += 1
+
+def setup(workdir):
+    """Point supybot at workdir and import the plugin."""
+
+    import supybot.conf as conf
+    for d in ('data', 'conf', 'backup', 'log'):
+        os.mkdir(os.path.join(workdir, d))
+        conf.supybot.directories.get(d).setValue(os.path.join(workdir, d))
+    conf.supybot.directories.data.tmp.setValue(os.path.join(workdir, 'data', 'tmp'))  # otherwise ./tmp gets made first.
+    sys.path.insert(0, HERE)
+    import config
+    import plugin
+    return (conf, plugin)
+
+def run(replaydir, verbose=False):
+    workdir = tempfile.mkdtemp()
+    # supybot flushes its databases into workdir from its own atexit handlers, so clean
+    # up after those. registered before supybot is imported, so it runs after them.
+    atexit.register(shutil.rmtree, workdir, True)
+    (conf, plugin) = setup(workdir)
+    if not replaydir:
+        replaydir = os.path.join(workdir, 'slate')
+        os.mkdir(replaydir)
+        buildslate(replaydir, plugin.TEAMNAMES)
+
+    class BenchSource(plugin.ReplaySource):
+        """ReplaySource on a clock we step ourselves. Counts fetches."""
+
+        def __init__(self, directory):
+            plugin.ReplaySource.__init__(self, directory)
+            self.clock = self.origin
+            self.fetches = 0
+            self.bytes = 0
+
+        def now(self):
+            return self.clock
+
+        def delay(self, secs):
+            return 0
+
+        def fetch(self, kind, key=None, conditional=False):
+            self.fetches += 1
+            page = plugin.ReplaySource.fetch(self, kind, key, conditional)
+            if page and page is not plugin.NOTMODIFIED:
+                self.bytes += len(page)
+            return page
+
+    settings = conf.supybot.plugins.Football
+    settings.replayDir.setValue(replaydir)
+    settings.floodBurst.setValue(100000)  # measure the plugin, not flood control.
+    irc = FakeIrc(['#bench'])
+    fb = plugin.Football(irc)
+    fb.ready.wait()
+    source = BenchSource(replaydir)
+    end = max([v[-1][0] for v in source.snapshots.values()]) + 600
+    (fb.source, fb.games, fb.sscache) = (source, None, {})
+    fb.channels = {'#bench': 1}
+    fb._invalidateout()
+    ticks = []
+    while source.clock <= end:
+        (fetches, nbytes, sent) = (source.fetches, source.bytes, irc.sent)
+        start = time.time()
+        if source.clock >= fb._oddsdue():  # what the footballodds job would do, in line so it is counted.
+            fb.checkfootballxml()
+        fb._tick(irc)
+        tick = {'clock': source.clock, 'ms': (time.time() - start) * 1000, 'fetches': source.fetches - fetches,
+                'bytes': source.bytes - nbytes, 'messages': irc.sent - sent}
+        ticks.append(tick)
+        if verbose:
+            print("{0} {1:8.2f}ms fetches={2} bytes={3} messages={4} next={5}".format(
+                  datetime.datetime.utcfromtimestamp(tick['clock']).strftime('%H:%M:%S'), tick['ms'],
+                  tick['fetches'], tick['bytes'], tick['messages'], fb.nextreason))
+        source.clock += max(1, fb.nextcheck - fb._utcnow())
+    fb.die()
+    times = sorted([t['ms'] for t in ticks])
+    return {'ticks': len(ticks),
+            'fetches': sum([t['fetches'] for t in ticks]),
+            'bytes': sum([t['bytes'] for t in ticks]),
+            'messages': sum([t['messages'] for t in ticks]),
+            'errors': fb.cronerrors,
+            'tick_ms_mean': sum(times) / len(times),
+            'tick_ms_p95': times[int(len(times) * 0.95)],
+            'tick_ms_max': times[-1],
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def compare(result, baseline, timings, tolerance):
+    """Returns a list of regressions against the baselines. timings may be None."""
+
+    problems = []
+    # these are deterministic for a given slate. more is a regression.
+    for k in ('ticks', 'fetches', 'bytes', 'errors'):
+        if result[k] > baseline[k]:
+            problems.append("{0}: {1} > baseline {2}".format(k, result[k], baseline[k]))
+    # different output is either a bug or needs a new baseline.
+    if result['messages'] != baseline['messages']:
+        problems.append("messages: {0} != baseline {1}".format(result['messages'], baseline['messages']))
+    # timings and memory get some slack.
+    for k in ('tick_ms_mean', 'tick_ms_p95', 'peak_rss_kb'):
+        if timings and result[k] > timings[k] * (1 + tolerance):
+            problems.append("{0}: {1:.2f} > baseline {2:.2f} (+{3:.0%})".format(k, result[k], timings[k], tolerance))
+    return problems
+
+def _load(fn):
+    if not os.path.exists(fn):
+        return None
+    with open(fn) as f:
+        return json.load(f)
+
+def _save(fn, result, keys):
+    with open(fn, 'w') as f:
+        json.dump(dict((k, result[k]) for k in keys), f, indent=2, sort_keys=True)
+        f.write("\n")
+    print("saved baseline to {0}".format(fn))
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('--replay', help="replay a directory recorded with recordDir instead of the synthetic slate")
+    parser.add_option('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_option('--tolerance', type='float', default=0.25, help="allowed slowdown for timings (default 0.25)")
+    parser.add_option('-v', '--verbose', action='store_true', help="print every tick")
+    (options, args) = parser.parse_args()
+    result = run(options.replay, options.verbose)
+    for k in sorted(result):
+        print("{0:>14}: {1}".format(k, round(result[k], 2) if isinstance(result[k], float) else result[k]))
+    if options.replay:  # the baselines are for the synthetic slate.
+        return 0
+    if options.save_baseline:
+        _save(BASELINE, result, COUNTS)
+        _save(TIMINGS, result, [k for k in result if k not in COUNTS])
+        return 0
+    baseline = _load(BASELINE)
+    if not baseline:
+        print("no baseline yet. run with --save-baseline to store one.")
+        return 0
+    timings = _load(TIMINGS)
+    if not timings:
+        print("no timings for this machine yet. run with --save-baseline to store them.")
+    problems = compare(result, baseline, timings, options.tolerance)
+    for p in problems:
+        print("REGRESSION {0}".format(p))
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
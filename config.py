@@ -28,6 +28,31 @@ Football = conf.registerPlugin('Football')
 # This is where your configuration variables (if any) should go.  For example:
 conf.registerChannelValue(Football, 'prefix', registry.Boolean(False, """Should we prefix output with the string"""))
 conf.registerChannelValue(Football, 'prefixString', registry.String("NFL: ", """Prefix String."""))
+conf.registerGlobalValue(Football, 'floodBurst', registry.PositiveInteger(5, """Lines we can send to a channel at once before flood control kicks in."""))
+conf.registerGlobalValue(Football, 'floodInterval', registry.PositiveInteger(2, """Seconds per line once a channel has used up floodBurst."""))
+conf.registerGlobalValue(Football, 'poolSize', registry.PositiveInteger(4, """Number of worker threads used to fetch game data concurrently. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'poolTimeout', registry.PositiveInteger(15, """Seconds to wait each tick for concurrent game fetches before moving on."""))
+conf.registerGlobalValue(Football, 'pollLive', registry.PositiveInteger(30, """Seconds between checks while games are live."""))
+conf.registerGlobalValue(Football, 'pollCrunch', registry.PositiveInteger(10, """Seconds between checks while a game is in a two-minute situation or overtime."""))
+conf.registerGlobalValue(Football, 'pollHalftime', registry.PositiveInteger(120, """Seconds between checks while the only games going are at halftime."""))
+conf.registerGlobalValue(Football, 'scoreGating', registry.Boolean(True, """Only fetch scoring details for games whose score changed on the scorestrip, instead of every live game each tick."""))
+conf.registerGlobalValue(Football, 'scoreRetryWindow', registry.PositiveInteger(300, """Seconds to keep checking a game for its scoring play after its score changes (TDs wait on the PAT)."""))
+conf.registerGlobalValue(Football, 'dedupeTTL', registry.PositiveInteger(691200, """Seconds we remember an announced scoring play or big play. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'dedupeMaxSize', registry.PositiveInteger(5000, """Most announced scoring/big plays we remember at once. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'httpTimeout', registry.PositiveInteger(10, """Seconds before an HTTP request to a feed times out."""))
+conf.registerGlobalValue(Football, 'httpPoolSize', registry.PositiveInteger(4, """Maximum idle keep-alive connections kept per host. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'httpIdleTimeout', registry.PositiveInteger(60, """Seconds an idle keep-alive connection is kept before it is closed. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'recordDir', registry.String("", """If set, every feed fetched from the live hosts is also saved in this directory for replay. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'replayDir', registry.String("", """If set, feeds are replayed from a directory made with recordDir instead of fetched live. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'replaySpeed', registry.PositiveInteger(1, """How many times faster than real time a replay runs. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'gtdCacheTTL', registry.PositiveInteger(20, """Seconds a downloaded game-center document is reused before fetching it again. Always kept under pollCrunch so each tick sees a fresh one."""))
+conf.registerGlobalValue(Football, 'statsInterval', registry.NonNegativeInteger(0, """Seconds between timing summaries in the log (see footballstats). 0 disables them."""))
+conf.registerGlobalValue(Football, 'oddsMaxAge', registry.PositiveInteger(14400, """Seconds before the cached betting lines are refreshed."""))
+conf.registerGlobalValue(Football, 'oddsLead', registry.PositiveInteger(1800, """Lines are also refreshed this many seconds before each kickoff slot so kickoffs show current ones."""))
+conf.registerGlobalValue(Football, 'pollThread', registry.Boolean(False, """Run checks in a thread of our own instead of the bot's scheduler, so slow feeds never stall the bot. Output is sent from the bot's thread. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'breakerThreshold', registry.PositiveInteger(3, """Failed fetches in a row before we stop hitting a feed endpoint for a while. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'breakerBackoff', registry.PositiveInteger(30, """Seconds a feed endpoint is first skipped once it keeps failing. Doubles on each further failure. (Requires reload)"""))
+conf.registerGlobalValue(Football, 'breakerMaxBackoff', registry.PositiveInteger(1800, """Most seconds a failing tick backs off for, or a failing feed endpoint is skipped (that one requires reload)."""))
 
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
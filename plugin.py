@@ -10,11 +10,26 @@ try:
 except ImportError:
     import xml.etree.ElementTree as ElementTree
 import cPickle as pickle
+import sqlite3  # state.
 from base64 import b64decode  # b64.
 import datetime  # utc time.
 import pytz  # utc time.
 from calendar import timegm  # utc time.
 import os
+import time
+import gzip  # http.
+import socket  # http.
+import httplib  # http.
+import urlparse  # http.
+from cStringIO import StringIO  # http.
+import threading  # fetch pool.
+import Queue  # fetch pool.
+from collections import OrderedDict  # dedupe.
+from collections import deque  # timings.
+import functools  # timings.
+import random  # backoff jitter.
+import tempfile  # odds cache.
+import heapq  # stat leaders.
 # extra supybot libs.
 import supybot.conf as conf
 import supybot.ircmsgs as ircmsgs
@@ -33,6 +48,593 @@ except:
     # without the i18n module
     _ = lambda x:x
 
+# outbound priority for each kind of event. lower goes out first.
+PRIORITY = {'score': 0, 'final': 0, 'finalstats': 1, 'kickoff': 2, 'status': 2, 'twominute': 3, 'redzone': 4, 'bigplay': 4}
+
+# full team names used by the odds feed.
+TEAMNAMES = {
+    'DEN':'Denver Broncos', 'NE':'New England Patriots', 'HOU':'Houston Texans', 'SF':'San Francisco 49ers',
+    'GB':'Green Bay Packers', 'SEA':'Seattle Seahawks', 'ATL':'Atlanta Falcons', 'NO':'New Orleans Saints',
+    'PIT':'Pittsburgh Steelers', 'BAL':'Baltimore Ravens', 'CIN':'Cincinnati Bengals', 'NYG':'New York Giants',
+    'DAL':'Dallas Cowboys', 'CHI':'Chicago Bears', 'IND':'Indianapolis Colts', 'WAS':'Washington Redskins',
+    'PHI':'Philadelphia Eagles', 'CAR':'Carolina Panthers', 'MIA':'Miami Dolphins', 'SD':'San Diego Chargers',
+    'TB':'Tampa Bay Buccaneers', 'KC':'Kansas City Chiefs', 'DET':'Detroit Lions', 'MIN':'Minnesota Vikings',
+    'STL':'St. Louis Rams', 'CLE':'Cleveland Browns', 'TEN':'Tennessee Titans', 'BUF':'Buffalo Bills',
+    'ARI':'Arizona Cardinals', 'NYJ':'New York Jets', 'OAK':'Oakland Raiders', 'JAC':'Jacksonville Jaguars',
+    'JAX':'Jacksonville Jaguars'}
+
+# all of our "times" are in Eastern. resolved once.
+EASTERN = pytz.timezone("US/Eastern")
+
+# returned by _httpget when a conditional request comes back 304.
+NOTMODIFIED = object()
+
+class GameState(object):
+    """One game from the scorestrip, with scores and clock already parsed."""
+
+    __slots__ = ('eid', 'd', 't', 'q', 'qtr', 'k', 'secs', 'p', 'h', 'hs', 'v', 'vs', 'rz', 'start')
+    # names for each part of signature(). event rules subscribe to these.
+    FIELDS = ('q', 'score', 'clock', 'rz', 'p')
+
+    def __init__(self, attrs, start, secs):
+        self.eid = attrs['eid']  # game id.
+        self.d = attrs.get('d')  # day.
+        self.t = attrs.get('t')  # kickoff time (12hr eastern).
+        self.q = attrs.get('q')  # status. P, 1-5, H, F, FO.
+        self.qtr = int(self.q) if self.q and self.q.isdigit() else 0  # quarter as an int. 0 if not playing.
+        self.k = attrs.get('k', '')  # clock as displayed.
+        self.secs = secs  # clock in seconds remaining. None if no clock.
+        self.p = attrs.get('p') or None  # team with possession.
+        self.h = attrs.get('h')  # home team.
+        self.hs = int(attrs.get('hs') or 0)  # home score.
+        self.v = attrs.get('v')  # visiting team.
+        self.vs = int(attrs.get('vs') or 0)  # visitor score.
+        self.rz = (attrs.get('rz') == "1")  # redzone.
+        self.start = start  # kickoff in UTC epoch seconds.
+
+    def signature(self):
+        """The parts of the game the event rules care about. Clock is bucketed around the 2 minute mark."""
+
+        return (self.q, (self.vs, self.hs), None if self.secs is None else (self.secs > 120), self.rz, self.p)
+
+class GameStats(object):
+    """Leaders and team totals for one game, indexed from its game-center (gtd) document.
+    Only the top n players by yards in each category are kept."""
+
+    CATEGORIES = ('passing', 'rushing', 'receiving')
+    # stat line for a player in each category.
+    FORMATS = {'passing': "{name} ({cmp}/{att}) TD: {tds} INT: {ints} YDS: {yds}",
+               'rushing': "{name} YDS: {yds} ATT: {att} TD: {tds}",
+               'receiving': "{name} YDS: {yds} TD: {tds}"}
+
+    def __init__(self, doc, when, n=3):
+        self.when = when  # source time of the document.
+        self.sides = {}  # away/home -> {'abbr': team, 'leaders': {category: [players]}, 'team': totals}.
+        for side in ('away', 'home'):
+            b = doc[side]['stats']
+            leaders = {}
+            for cat in self.CATEGORIES:
+                leaders[cat] = heapq.nlargest(n, b.get(cat, {}).itervalues(), key=lambda x: x['yds'])
+            self.sides[side] = {'abbr': doc[side]['abbr'], 'leaders': leaders, 'team': b['team']}
+
+    def side(self, team):
+        """away or home for team. None if they're not in this game."""
+
+        for (side, v) in self.sides.items():
+            if v['abbr'] == team:
+                return side
+        return None
+
+    def line(self, side, cat, i=0):
+        """Stat line for the i-th leader in cat. Raises IndexError if there is not one."""
+
+        player = dict(self.sides[side]['leaders'][cat][i])
+        player['name'] = player['name'].encode('utf-8')
+        return self.FORMATS[cat].format(**player)
+
+    def totals(self, side):
+        t = self.sides[side]['team']
+        return "TO: {0} YDS: {1} FD: {2} TOP: {3}".format(t['trnovr'], t['totyds'], t['totfd'], t['top'])
+
+class DedupeStore(object):
+    """Ids we've already announced, grouped by game. Entries expire after ttl
+    seconds and the oldest are evicted once there are more than maxsize."""
+
+    def __init__(self, ttl, maxsize, journal=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.journal = journal  # optional callable(op, gid, key, added) told about every change.
+        self.entries = OrderedDict()  # (gid, id) -> time added. oldest first.
+        self.stats = {'added': 0, 'expired': 0, 'evicted': 0, 'purged': 0}
+
+    def _journal(self, *args):
+        if self.journal:
+            self.journal(*args)
+
+    def load(self, entries):
+        """Restore (gid, id, added) entries, e.g. from a StateStore."""
+
+        for (gid, key, added) in sorted(entries, key=lambda e: e[2]):
+            self.entries[(gid, key)] = added
+        self.expire()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def seen(self, gid, key):
+        return (gid, key) in self.entries
+
+    def add(self, gid, key, when=None):
+        if (gid, key) in self.entries:
+            return
+        self.entries[(gid, key)] = when or time.time()
+        self.stats['added'] += 1
+        self._journal('add', gid, key, self.entries[(gid, key)])
+        while len(self.entries) > self.maxsize:  # over the cap. drop the oldest.
+            ((g, k), added) = self.entries.popitem(last=False)
+            self.stats['evicted'] += 1
+            self._journal('del', g, k, added)
+
+    def expire(self, now=None):
+        """Drop entries older than ttl."""
+
+        now = now or time.time()
+        while self.entries:
+            (k, added) = next(self.entries.iteritems())
+            if now - added < self.ttl:
+                break
+            del self.entries[k]
+            self.stats['expired'] += 1
+            self._journal('del', k[0], k[1], added)
+
+    def purge(self, gid):
+        """Drop everything for a game."""
+
+        keys = [k for k in self.entries if k[0] == gid]
+        for k in keys:
+            del self.entries[k]
+            self.stats['purged'] += 1
+        if keys:
+            self._journal('purge', gid, None, None)
+
+class StateStore(object):
+    """
+    SQLite-backed plugin state: channels, dedupe entries and small pickled values.
+    Every write is its own transaction, so a crash never leaves a half-written file.
+    """
+
+    def __init__(self, filename, log):
+        self.log = log
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # cheap incremental writes.
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS channels (channel TEXT PRIMARY KEY, enabled INTEGER, teams TEXT DEFAULT '', kinds TEXT DEFAULT '')")
+            columns = [r[1] for r in self.conn.execute("PRAGMA table_info(channels)")]
+            for column in ('teams', 'kinds'):  # databases from before subscriptions.
+                if column not in columns:
+                    self.conn.execute("ALTER TABLE channels ADD COLUMN {0} TEXT DEFAULT ''".format(column))
+            self.conn.execute("CREATE TABLE IF NOT EXISTS dedupe (store TEXT, gid TEXT, key TEXT, added REAL, PRIMARY KEY (store, gid, key))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB)")
+
+    def _write(self, sql, args):
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.execute(sql, args)
+            except sqlite3.Error as e:
+                self.log.error("StateStore: ERROR writing :: {0}".format(e))
+
+    def _read(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def channels(self):
+        return dict((str(c), e) for (c, e) in self._read("SELECT channel, enabled FROM channels"))
+
+    def subscriptions(self):
+        """channel -> (teams, kinds). Empty sets mean everything."""
+
+        return dict((str(c), (frozenset(str(t or '').split()), frozenset(str(k or '').split())))
+                    for (c, t, k) in self._read("SELECT channel, teams, kinds FROM channels"))
+
+    def setchannel(self, channel, enabled):
+        self._write("INSERT OR REPLACE INTO channels VALUES (?, ?, COALESCE((SELECT teams FROM channels WHERE channel = ?), ''), "
+                    "COALESCE((SELECT kinds FROM channels WHERE channel = ?), ''))", (channel, enabled, channel, channel))
+
+    def setsubscriptions(self, channel, teams, kinds):
+        self._write("UPDATE channels SET teams = ?, kinds = ? WHERE channel = ?", (" ".join(sorted(teams)), " ".join(sorted(kinds)), channel))
+
+    def delchannel(self, channel):
+        self._write("DELETE FROM channels WHERE channel = ?", (channel,))
+
+    def dedupe(self, store, op, gid, key, added):
+        """Journal for a DedupeStore. op is add, del or purge."""
+
+        if op == 'add':
+            self._write("INSERT OR REPLACE INTO dedupe VALUES (?, ?, ?, ?)", (store, gid, key, added))
+        elif op == 'del':
+            self._write("DELETE FROM dedupe WHERE store = ? AND gid = ? AND key = ?", (store, gid, key))
+        elif op == 'purge':
+            self._write("DELETE FROM dedupe WHERE store = ? AND gid = ?", (store, gid))
+
+    def loaddedupe(self, store):
+        return [(str(g), str(k), a) for (g, k, a) in self._read("SELECT gid, key, added FROM dedupe WHERE store = ?", (store,))]
+
+    def get(self, key, default=None):
+        rows = self._read("SELECT value FROM kv WHERE key = ?", (key,))
+        if not rows:
+            return default
+        try:
+            return pickle.loads(str(rows[0][0]))
+        except Exception as e:  # bad or old pickle.
+            self.log.error("StateStore: ERROR loading {0} :: {1}".format(key, e))
+            return default
+
+    def put(self, key, value):
+        self._write("INSERT OR REPLACE INTO kv VALUES (?, ?)", (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class LiveSource(object):
+    """Fetches the feeds from the live hosts. If recorddir is set, everything
+    fetched is also saved there for ReplaySource. Recording problems are logged
+    and never get in the way of a live fetch."""
+
+    URLS = {
+        'scorestrip': 'aHR0cDovL3d3dy5uZmwuY29tL2xpdmV1cGRhdGUvc2NvcmVzdHJpcC9zcy54bWw=',
+        'postseason': 'aHR0cDovL3d3dy5uZmwuY29tL2xpdmV1cGRhdGUvc2NvcmVzdHJpcC9wb3N0c2Vhc29uL3NzLnhtbA==',
+        'gtd': 'aHR0cDovL3d3dy5uZmwuY29tL2xpdmV1cGRhdGUvZ2FtZS1jZW50ZXIv',
+        'odds': 'aHR0cDovL2xpdmVsaW5lcy5iZXRvbmxpbmUuY29tL3N5cy9MaW5lWE1ML0xpdmVMaW5lT2JqWG1sLmFzcD9zcG9ydD1Gb290YmFsbCZzdWJzcG9ydD1ORkw='}
+
+    def __init__(self, httpget, log, recorddir=None):
+        self.httpget = httpget  # callable(url, conditional).
+        self.log = log
+        self.recorddir = recorddir
+        self.lock = threading.Lock()
+        self.seq = 0
+        if recorddir and not os.path.isdir(recorddir):
+            try:
+                os.makedirs(recorddir)
+            except OSError, e:
+                self.log.error("LiveSource: ERROR creating recordDir {0} :: {1}".format(recorddir, e))
+
+    def url(self, kind, key=None):
+        url = b64decode(self.URLS[kind])
+        if kind == 'gtd':
+            url += '%s/%s_gtd.json' % (key, key)
+        return url
+
+    def now(self):
+        return time.time()
+
+    def delay(self, secs):
+        """Real seconds for secs of source time."""
+
+        return secs
+
+    def fetch(self, kind, key=None, conditional=False):
+        page = self.httpget(self.url(kind, key), conditional)
+        if self.recorddir and page and page is not NOTMODIFIED:
+            self._record(kind, key, page)
+        return page
+
+    def _record(self, kind, key, page):
+        with self.lock:
+            self.seq += 1
+            fn = "{0:07d}-{1}{2}".format(self.seq, kind, "-{0}".format(key) if key else "")
+            try:
+                with open(os.path.join(self.recorddir, fn), 'wb') as f:
+                    f.write(page)
+                with open(os.path.join(self.recorddir, 'index.jsonl'), 'a') as f:
+                    f.write(json.dumps({'t': time.time(), 'kind': kind, 'key': key, 'file': fn}) + "\n")
+            except (IOError, OSError), e:  # disk full, directory gone. the live fetch still worked.
+                self.log.error("LiveSource: ERROR recording {0} :: {1}".format(fn, e))
+
+class ReplaySource(object):
+    """Serves feeds recorded by LiveSource with their original timing. Replay
+    time starts at the first recording and runs speed times faster than real time."""
+
+    def __init__(self, directory, speed=1):
+        self.directory = directory
+        self.speed = speed
+        self.snapshots = {}  # (kind, key) -> sorted list of (t, file).
+        with open(os.path.join(directory, 'index.jsonl')) as f:
+            for line in f:
+                if line.strip():
+                    e = json.loads(line)
+                    self.snapshots.setdefault((e['kind'], e['key']), []).append((e['t'], str(e['file'])))
+        for v in self.snapshots.values():
+            v.sort()
+        self.origin = min([v[0][0] for v in self.snapshots.values()] or [time.time()])
+        self.started = time.time()
+        self.served = {}  # (kind, key) -> file we served last. for conditional fetches.
+
+    def url(self, kind, key=None):
+        return "replay://{0}/{1}".format(kind, key or "")
+
+    def now(self):
+        return self.origin + (time.time() - self.started) * self.speed
+
+    def delay(self, secs):
+        return secs / float(self.speed)
+
+    def fetch(self, kind, key=None, conditional=False):
+        now = self.now()
+        snaps = [fn for (t, fn) in self.snapshots.get((kind, key), []) if t <= now]
+        if not snaps:  # nothing recorded yet at this point in the replay.
+            return None
+        if conditional and self.served.get((kind, key)) == snaps[-1]:
+            return NOTMODIFIED
+        self.served[(kind, key)] = snaps[-1]
+        with open(os.path.join(self.directory, snaps[-1]), 'rb') as f:
+            return f.read()
+
+class FetchPool(object):
+    """Fixed-size pool of daemon threads used to fan out HTTP fetches."""
+
+    def __init__(self, size, log):
+        self.log = log
+        self.tasks = Queue.Queue()
+        self.workers = []
+        for i in range(size):
+            t = threading.Thread(target=self._worker, name="FootballFetch-{0}".format(i))
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def _worker(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:  # shutdown.
+                return
+            (func, arg, results, deadline) = task
+            if time.time() > deadline:  # stale work from a tick that already moved on.
+                continue
+            try:
+                res = func(arg)
+            except Exception, e:
+                self.log.exception("FetchPool: ERROR running {0}({1}) :: {2}".format(getattr(func, '__name__', func), arg, e))
+                res = None
+            results.put((arg, res))
+
+    def imap(self, func, args, timeout):
+        """Run func over each arg. Yields (arg, result) as each one finishes,
+        until all have or timeout seconds have elapsed."""
+
+        results = Queue.Queue()
+        deadline = time.time() + timeout
+        for arg in args:
+            self.tasks.put((func, arg, results, deadline))
+        for i in range(len(args)):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            try:
+                yield results.get(True, remaining)
+            except Queue.Empty:
+                return
+
+    def map(self, func, args, timeout):
+        """Like imap but waits for everything. Returns a dict of arg->result for
+        everything that finished before timeout seconds elapsed."""
+
+        return dict(self.imap(func, args, timeout))
+
+    def stop(self):
+        for w in self.workers:
+            self.tasks.put(None)
+
+class HTTPPool(object):
+    """Per-host pool of keep-alive HTTP connections. Requests can go through an
+    HTTP proxy (host:port): plain http is sent to it, https is tunneled with CONNECT."""
+
+    def __init__(self, maxsize, idle, timeout):
+        self.maxsize = maxsize  # max idle connections kept per host.
+        self.idle = idle  # seconds before an idle connection is dropped.
+        self.timeout = timeout
+        self.pools = {}  # (scheme, host, port, proxy) -> list of (conn, lastused).
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'new': 0, 'reused': 0, 'expired': 0, 'errors': 0}
+
+    def _get(self, key, fresh=False):
+        """Returns (conn, reused) for key, reusing an idle connection if we can."""
+
+        now = time.time()
+        with self.lock:
+            idle = self.pools.get(key, [])
+            while idle and not fresh:
+                (conn, lastused) = idle.pop()
+                if now - lastused < self.idle:
+                    self.stats['reused'] += 1
+                    return (conn, True)
+                conn.close()  # idle too long.
+                self.stats['expired'] += 1
+            self.stats['new'] += 1
+        (scheme, host, port, proxy) = key
+        if proxy:
+            (phost, pport) = proxy.rsplit(':', 1)
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(phost, int(pport), timeout=self.timeout)
+                conn.set_tunnel(host, port)
+                return (conn, False)
+            return (httplib.HTTPConnection(phost, int(pport), timeout=self.timeout), False)
+        if scheme == 'https':
+            return (httplib.HTTPSConnection(host, port, timeout=self.timeout), False)
+        return (httplib.HTTPConnection(host, port, timeout=self.timeout), False)
+
+    def _put(self, key, conn):
+        """Return a connection to the pool, or close it if the pool is full."""
+
+        with self.lock:
+            idle = self.pools.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def request(self, url, headers, proxy=None):
+        """GET url, through proxy if given. Returns (status, headers, body). Network errors are raised."""
+
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80), proxy or None)
+        path = parts.path or '/'
+        if parts.query:
+            path = "{0}?{1}".format(path, parts.query)
+        if proxy and parts.scheme != 'https':  # the proxy wants the whole url.
+            path = urlparse.urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+        with self.lock:
+            self.stats['requests'] += 1
+        (conn, reused) = self._get(key)
+        while True:
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:  # a fresh connection failed so give up.
+                    with self.lock:
+                        self.stats['errors'] += 1
+                    raise
+                # the host probably dropped our idle connection. retry once on a new one.
+                (conn, reused) = self._get(key, fresh=True)
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return (resp.status, resp.msg, body)
+
+    def close(self):
+        with self.lock:
+            for idle in self.pools.values():
+                for (conn, lastused) in idle:
+                    conn.close()
+            self.pools = {}
+
+def backoff(attempt, base, cap):
+    """Seconds to wait before retry number attempt (1 is the first). Doubles from base up to cap,
+    then picks somewhere in the top half of that so retries from a bad minute spread out."""
+
+    delay = min(cap, base * 2 ** min(attempt-1, 16))
+    return delay/2.0 + random.uniform(0, delay/2.0)
+
+class CircuitBreaker(object):
+    """Circuit breakers keyed by feed endpoint, ie: ('gtd', gid). After threshold failures in a row
+    an endpoint is open and skipped for a backoff that grows with each failure. Once that runs out,
+    one probe is let through (half-open). Success closes the breaker, failure opens it again."""
+
+    def __init__(self, threshold, base, cap):
+        self.threshold = threshold
+        self.base = base
+        self.cap = cap
+        self.endpoints = {}  # endpoint -> [failures in a row, open until, probe out].
+        self.lock = threading.Lock()
+        self.stats = {'opened': 0, 'skipped': 0, 'probes': 0}
+
+    def allow(self, endpoint, now):
+        """Can we hit endpoint now?"""
+
+        with self.lock:
+            e = self.endpoints.get(endpoint)
+            if not e or e[0] < self.threshold:  # closed.
+                return True
+            if now < e[1] or e[2]:  # open, or half-open with a probe already out.
+                self.stats['skipped'] += 1
+                return False
+            e[2] = True  # half-open. this one is the probe.
+            self.stats['probes'] += 1
+            return True
+
+    def success(self, endpoint):
+        """Returns True if this closed an open breaker."""
+
+        with self.lock:
+            e = self.endpoints.pop(endpoint, None)
+            return bool(e and e[0] >= self.threshold)
+
+    def failure(self, endpoint, now):
+        """Returns seconds the endpoint is now open for, or None if it is still closed."""
+
+        with self.lock:
+            e = self.endpoints.setdefault(endpoint, [0, 0, False])
+            e[0] += 1
+            e[2] = False
+            if e[0] < self.threshold:
+                return None
+            delay = backoff(e[0]-self.threshold+1, self.base, self.cap)
+            e[1] = now + delay
+            self.stats['opened'] += 1
+            return delay
+
+    def until(self, endpoint):
+        """When endpoint's breaker lets a probe through, or None if it is closed."""
+
+        with self.lock:
+            e = self.endpoints.get(endpoint)
+            return e[1] if e and e[0] >= self.threshold else None
+
+    def opened(self):
+        """Endpoints whose breaker is open or half-open."""
+
+        with self.lock:
+            return [k for (k, e) in self.endpoints.items() if e[0] >= self.threshold]
+
+class Timings(object):
+    """Rolling timings per span name. Keeps the last size durations (ms) for
+    percentiles and lifetime call counts. Safe to use from the fetch pool."""
+
+    def __init__(self, size=500):
+        self.size = size
+        self.samples = {}  # name -> deque of ms.
+        self.calls = {}  # name -> total calls.
+        self.lock = threading.Lock()
+
+    def add(self, name, ms):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.size)
+                self.calls[name] = 0
+            self.samples[name].append(ms)
+            self.calls[name] += 1
+
+    def summary(self, name):
+        """Returns (calls, mean, p50, p95, max) in ms over the window, or None."""
+
+        with self.lock:
+            if not self.samples.get(name):
+                return None
+            ms = sorted(self.samples[name])
+            calls = self.calls[name]
+        return (calls, sum(ms)/len(ms), ms[len(ms)//2], ms[int(len(ms)*0.95)], ms[-1])
+
+    def report(self):
+        """One 'name n=.. avg=.. p50=.. p95=.. max=..' string per span."""
+
+        out = []
+        for name in sorted(self.samples):
+            s = self.summary(name)
+            if s:
+                out.append("{0} n={1} avg={2:.1f}ms p50={3:.1f}ms p95={4:.1f}ms max={5:.1f}ms".format(name, *s))
+        return out
+
+def timed(name):
+    """Decorator for Football methods. Times each call into self.timings under name."""
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.timings.add(name, (time.time()-start)*1000)
+        return wrapper
+    return decorate
+
 class Football(callbacks.Plugin):
     """Add the help for "@plugin help Football" here
     This should describe *how* to use this plugin."""
@@ -41,93 +643,356 @@ class Football(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(Football, self)
         self.__parent.__init__(irc)
+        initstart = time.time()
         # initial states for games.
         self.games = None
-        self.nextcheck = None
-        self.scoredict = {}  # for scoring events.
+        self.gamesat = None  # source time the scorestrip behind self.games was last confirmed.
+        self.nextcheck = None  # when checkfootball runs next (epoch).
+        self.nextreason = None  # and why.
+        # durable state. see _loadstate.
+        self.state = StateStore(conf.supybot.directories.data.dirize(self.name()+".db"), self.log)
+        self.scoredupe = DedupeStore(self.registryValue('dedupeTTL'), self.registryValue('dedupeMaxSize'),
+                                     lambda *args: self.state.dedupe('score', *args))  # scoring events we posted.
+        self.scorepending = {}  # gid -> time we stop looking for its scoring play. see scoreGating.
         # dict for big plays and dupedict.
         self.bps = {}
-        self.bpsdupe = set([])
-        # now setup the empty channels dict.
+        self.bpsdupe = DedupeStore(self.registryValue('dedupeTTL'), self.registryValue('dedupeMaxSize'),
+                                   lambda *args: self.state.dedupe('bps', *args))
+        # game-center (gtd) json cache. gid -> (fetched, doc).
+        self.gtdcache = {}
+        self.gamestats = {}  # gid -> GameStats from its latest gtd document. see _fetchgtd.
+        self.gtdstats = {'hits': 0, 'misses': 0}
+        self.gtdlock = threading.Lock()
+        # http validators (etag, last-modified) per url and parsed scorestrips per url.
+        self.validators = {}
+        self.sscache = {}
+        # where tick latency goes. see timed and footballstats.
+        self.timings = Timings()
+        self.cronerrors = 0
+        self.lasterror = None  # (epoch, error) of the last tick that blew up.
+        self.statslogged = time.time()
+        self.cronstreak = 0  # ticks in a row that blew up. see _tick.
+        # per-endpoint circuit breakers for the feeds. see _fetch.
+        self.breakers = CircuitBreaker(self.registryValue('breakerThreshold'), self.registryValue('breakerBackoff'), self.registryValue('breakerMaxBackoff'))
+        self.kickoffs = {}  # (eid, t) -> kickoff epoch. see _fetchgames.
+        # where the feeds come from. live hosts, or a recorded replay.
+        if self.registryValue('replayDir'):
+            self.source = ReplaySource(self.registryValue('replayDir'), self.registryValue('replaySpeed'))
+        else:
+            self.source = LiveSource(self._httpget, self.log, self.registryValue('recordDir') or None)
+        # now setup the empty channels dict. _warmup loads them.
         self.channels = {}
-        self._loadpickle()  # load saved data into channels.
+        self.subs = {}  # channel -> (teams, event kinds) it wants. empty means all. see _recipients.
+        # output. see _post/_flush.
+        self.outbox = {}  # channel -> entries waiting to go out.
+        self.outseq = 0  # keeps entries of the same priority in order.
+        self.outlock = threading.Lock()
+        self.buckets = {}  # channel -> (tokens, last refill). flood control.
+        self.outchans = None  # cached prefix -> channels.
+        self.outchansat = 0
+        # registry edits to the prefix settings drop the cache.
+        # removeCallback matches by identity and every self._invalidateout is a new bound method, so keep one.
+        self.prefixvalues = (conf.supybot.plugins.Football.prefix, conf.supybot.plugins.Football.prefixString)
+        self.prefixcb = self._invalidateout
+        for value in self.prefixvalues:
+            value.addCallback(self.prefixcb)
         # Odds XML cache.
         self.CACHEFILE = conf.supybot.directories.data.dirize(self.name()+".xml")
-        # now do our initial run.
-        if not self.games:
-            self.games = self._fetchgames()
-        # now setup the regular cron.
-        def checkfootballcron():
+        self.odds = {}  # (away, home) -> line. see _loadodds.
+        self.oddsmtime = None
+        self.oddsfetched = None  # source time the lines were last known current. see _oddsdue.
+        self.oddslock = threading.Lock()  # one refresh at a time.
+        # worker pool for concurrent per-game fetches.
+        self.fetchpool = FetchPool(self.registryValue('poolSize'), self.log)
+        # event rules and the GameState.FIELDS changes they run on.
+        self.rules = ((set(['rz']), self._evredzone),
+                      (set(['q', 'clock']), self._evtwominute),
+                      (set(['q']), self._evstatus))
+        # keep-alive connections for _httpget.
+        self.httppool = HTTPPool(self.registryValue('httpPoolSize'), self.registryValue('httpIdleTimeout'), self.registryValue('httpTimeout'))
+        # loading saved state, the odds cache and the first scorestrip happens in _warmup
+        # so loading the plugin never waits on disk or the network.
+        self.stateready = threading.Event()  # channels and saved state are loaded.
+        self.ready = threading.Event()  # and we have games.
+        self.startup = {}  # ms each startup step took. see footballstats.
+        # now setup the cron. each run works out when the next one should be.
+        # with pollThread, ticks run in our own thread instead and the bot only sends what they queue.
+        self.pollstop = threading.Event()
+        self.poller = None
+        def startcron():
+            if not self.ready.is_set():  # come back once _warmup is done.
+                schedule.addEvent(startcron, time.time()+1, name='footballstart')
+                return
+            # first run. if we picked up where we left off, keep the schedule we had.
+            if not self.nextcheck or self.nextcheck < self._utcnow():
+                self.nextcheck = self._utcnow()+self.registryValue('pollLive')
+                self.nextreason = "startup"
+            # odds refresh on their own. the job only starts a download when _oddsdue says so.
+            schedule.addPeriodicEvent(self._oddsjob, 60, name='footballodds')
+            if self.registryValue('pollThread'):
+                schedule.addPeriodicEvent(lambda: self._flush(irc), 1, name='footballdrain', now=False)
+                self.poller = threading.Thread(target=self._pollloop, args=(irc,), name="FootballPoller")
+                self.poller.daemon = True
+                self.poller.start()
+            else:
+                self._schedulecheck(lambda: self._crontick(irc))
+        warmup = threading.Thread(target=self._warmup, args=(initstart,), name="FootballWarmup")
+        warmup.daemon = True
+        warmup.start()
+        startcron()
+        self.startup['init'] = (time.time()-initstart)*1000
+
+    def _warmup(self, initstart):
+        """Startup work that touches disk or the network, off the bot's thread."""
+
+        try:
+            start = time.time()
+            self._loadstate()  # load saved channels and, if it's fresh, where we left off.
+            self.startup['state'] = (time.time()-start)*1000
+            self.stateready.set()
+            start = time.time()
+            if self._loadodds() and self.oddsmtime <= self.source.now():  # lines we cached before a reload still count.
+                self.oddsfetched = self.oddsmtime
+            self.startup['odds'] = (time.time()-start)*1000
+            # now do our initial run.
+            start = time.time()
+            if not self.games:
+                self.games = self._fetchgames()
+            self.startup['games'] = (time.time()-start)*1000
+        except Exception, e:  # checkfootball fetches games itself if we did not get them.
+            self.log.exception("_warmup: ERROR :: {0}".format(e))
+        finally:
+            self.stateready.set()
+            self.ready.set()
+            self.startup['ready'] = (time.time()-initstart)*1000
+            self.log.info("_warmup: ready in {0:.0f}ms ({1})".format(self.startup['ready'], self._startuptimes()))
+
+    def _startuptimes(self):
+        return " ".join(["{0}={1:.0f}ms".format(k, self.startup[k]) for k in ('init', 'state', 'odds', 'games', 'ready') if k in self.startup])
+
+    def _warmingup(self, irc, event=None):
+        """For commands. Waits a moment for event (default: fully warmed up), then
+        replies and returns True if it still is not set."""
+
+        if (event or self.ready).wait(3):
+            return False
+        irc.reply("Football is still warming up. Try again in a moment.")
+        return True
+
+    def _tick(self, irc, flush=True):
+        """One checkfootball run with error handling, then output and bookkeeping."""
+
+        start = time.time()
+        try:
+            self.checkfootball(irc)
+            self.cronstreak = 0
+        except Exception, e:  # something broke. back off so the plugin does not spam, longer each time it happens.
+            self.cronerrors += 1
+            self.cronstreak += 1
+            self.lasterror = (int(time.time()), str(e))
+            delay = int(backoff(self.cronstreak, self.registryValue('pollLive'), self.registryValue('breakerMaxBackoff')))
+            self.log.exception("cron: ERROR :: {0} (failure {1} in a row, backing off {2}s)".format(e, self.cronstreak, delay))
+            self.nextcheck = self._utcnow()+delay
+            self.nextreason = "error: {0}".format(e)
+        self.timings.add('tick', (time.time()-start)*1000)
+        # bookkeeping. a failure here is logged but must not stop the cron, or the other steps.
+        steps = [self._savestate, self._logstats]
+        if flush:
+            steps.insert(0, lambda: self._flush(irc))  # send whatever this tick produced.
+        for step in steps:
             try:
-                self.checkfootball(irc)
-            except Exception, e:  # something broke. The plugin will stop itself from reporting.
-                self.log.error("cron: ERROR :: {0}".format(e))
-                self.nextcheck = self._utcnow()+72000  # add some major delay so the plugin does not spam.
-        # now setup the schedule part of the cron.
+                step()
+            except Exception, e:
+                self.log.exception("cron: ERROR after checkfootball :: {0}".format(e))
+
+    def _crontick(self, irc):
+        """checkfootball event. The events are a one-shot chain, so the next one is
+        scheduled whatever happens to this one."""
+
         try:
-            schedule.addPeriodicEvent(checkfootballcron, 30, now=False, name='checkfootball')
-        except AssertionError:
+            self._tick(irc)
+        finally:
+            self._schedulecheck(lambda: self._crontick(irc))
+
+    def _pollloop(self, irc):
+        """pollThread body. Sleeps until nextcheck and ticks. Slow feeds only hold up this thread;
+        posts go through the outbox and the footballdrain event sends them from the bot's thread."""
+
+        while not self.pollstop.is_set():
             try:
-                schedule.removeEvent('checkfootball')
-            except KeyError:
-                pass
-            schedule.addPeriodicEvent(checkfootballcron, 30, now=False, name='checkfootball')
+                wait = self.source.delay(self.nextcheck-self._utcnow())
+                if wait > 0:
+                    self.pollstop.wait(min(wait, 60))
+                    continue
+                self._tick(irc, flush=False)
+                self.log.info("checkfootball: next check in {0}s ({1})".format(self.nextcheck-self._utcnow(), self.nextreason))
+            except Exception, e:  # keep polling. wait a bit so a persistent error does not spin.
+                self.log.exception("_pollloop: ERROR :: {0}".format(e))
+                self.pollstop.wait(self.registryValue('pollLive'))
 
     def die(self):
-        try:  # remove scores cron.
-            schedule.removeEvent('checkfootball')
-        except KeyError:
-            pass
+        for name in ('footballstart', 'checkfootball', 'footballflush', 'footballdrain', 'footballodds'):  # remove scores cron, odds job and pending output.
+            try:
+                schedule.removeEvent(name)
+            except KeyError:
+                pass
+        if self.poller:  # let a tick in progress finish.
+            self.pollstop.set()
+            self.poller.join(self.registryValue('httpTimeout')*2)
+        for value in self.prefixvalues:
+            try:
+                value.removeCallback(self.prefixcb)
+            except (AttributeError, ValueError):
+                pass
+        self.fetchpool.stop()
+        self.httppool.close()
+        self._savestate()
+        self.state.close()
         self.__parent.die()
 
     #####################
     # INTERNAL COMMANDS #
     #####################
 
-    def _httpget(self, url):
-        """General HTTP resource fetcher."""
+    def _schedulecheck(self, func):
+        """(Re)schedule the one-shot checkfootball event for self.nextcheck."""
 
         try:
-            headers = {"User-Agent":"Mozilla/5.0 (X11; Ubuntu; Linux i686; rv:17.0) Gecko/20100101 Firefox/17.0"}
-            page = utils.web.getUrl(url, headers=headers)
-            return page
-        except utils.web.Error as e:
-            self.log.error("ERROR opening {0} message: {1}".format(url, e))
+            schedule.removeEvent('checkfootball')
+        except KeyError:
+            pass
+        schedule.addEvent(func, time.time()+self.source.delay(self.nextcheck-self._utcnow()), name='checkfootball')
+        self.log.info("checkfootball: next check in {0}s ({1})".format(self.nextcheck-self._utcnow(), self.nextreason))
+
+    def _fetch(self, kind, key=None, conditional=False):
+        """self.source.fetch behind the endpoint's circuit breaker. Returns None while it is open."""
+
+        endpoint = (kind, key)
+        if not self.breakers.allow(endpoint, self._utcnow()):
             return None
+        try:
+            page = self.source.fetch(kind, key, conditional)
+        except Exception, e:  # bad gzip, a replay file gone missing. still a failure, or a probe would never finish.
+            self.log.exception("_fetch: ERROR fetching {0} :: {1}".format(self.source.url(kind, key), e))
+            page = None
+        if page:  # NOTMODIFIED counts. the host answered.
+            if self.breakers.success(endpoint):
+                self.log.info("_fetch: {0} is back. closing its breaker.".format(self.source.url(kind, key)))
+        else:
+            delay = self.breakers.failure(endpoint, self._utcnow())
+            if delay is not None:
+                self.log.error("_fetch: {0} keeps failing. skipping it for {1}s.".format(self.source.url(kind, key), int(delay)))
+        return page
+
+    def _statslines(self):
+        """Timings and counters for footballstats and the periodic log line."""
+
+        lines = self.timings.report()
+        lines.append("startup {0}{1}".format(self._startuptimes(), "" if self.ready.is_set() else " (warming up)"))
+        opened = ["{0}/{1} ({2}s)".format(k[0], k[1] or "", int((self.breakers.until(k) or 0)-self._utcnow())) for k in sorted(self.breakers.opened())]
+        lines.append("breakers open={0} {1}".format(", ".join(opened) or "none", " ".join(["{0}={1}".format(k, v) for (k, v) in sorted(self.breakers.stats.items())])))
+        lines.append("cron errors={0} last={1}".format(self.cronerrors, "{0} ({1}s ago)".format(self.lasterror[1], int(time.time())-self.lasterror[0]) if self.lasterror else "none"))
+        counters = lambda d: " ".join(["{0}={1}".format(k, v) for (k, v) in sorted(d.items())])
+        lines.append("gtd {0} | http {1} | scoredupe size={2} {3} | bpsdupe size={4} {5}".format(
+                     counters(self.gtdstats), counters(self.httppool.stats), len(self.scoredupe), counters(self.scoredupe.stats),
+                     len(self.bpsdupe), counters(self.bpsdupe.stats)))
+        return lines
 
-    ##########################
-    # CHANNEL SAVE INTERNALS #
-    ##########################
+    def _logstats(self):
+        """Log _statslines every statsInterval seconds, if set."""
 
-    def _loadpickle(self):
-        """Load channel data from pickle."""
+        interval = self.registryValue('statsInterval')
+        if interval and time.time()-self.statslogged >= interval:
+            self.statslogged = time.time()
+            self.log.info("stats: {0}".format(" | ".join(self._statslines())))
 
+    def _httpget(self, url, conditional=False):
+        """General HTTP resource fetcher.
+
+        The ETag/Last-Modified of every good response are remembered. If conditional is True,
+        they are sent back and NOTMODIFIED is returned if the resource has not changed.
+        """
+
+        headers = {"User-Agent":"Mozilla/5.0 (X11; Ubuntu; Linux i686; rv:17.0) Gecko/20100101 Firefox/17.0",
+                   "Accept-Encoding":"gzip"}
+        if conditional and url in self.validators:  # send back what we were given last time.
+            (etag, lastmod) = self.validators[url]
+            if etag:
+                headers['If-None-Match'] = etag
+            if lastmod:
+                headers['If-Modified-Since'] = lastmod
+        proxy = conf.supybot.protocols.http.proxy()  # same proxy as the rest of the bot.
         try:
-            datafile = open(conf.supybot.directories.data.dirize(self.name()+".pickle"), 'rb')
+            location = url
+            for i in range(3):  # follow a few redirects.
+                (status, info, page) = self.httppool.request(location, headers, proxy)
+                if status not in (301, 302, 303, 307) or not info.get('Location'):
+                    break
+                location = urlparse.urljoin(location, info.get('Location'))
+        except (httplib.HTTPException, socket.error) as e:
+            self.log.error("ERROR opening {0} message: {1}".format(url, e))
+            return None
+        if status == 304:  # not modified.
+            return NOTMODIFIED
+        elif status != 200:
+            self.log.error("ERROR opening {0} message: HTTP {1}".format(url, status))
+            return None
+        # decompress if we have to.
+        if info.get('Content-Encoding') == 'gzip':
             try:
-                dataset = pickle.load(datafile)
-            finally:
-                datafile.close()
-        except IOError:
-            return False
-        # restore.
-        self.channels = dataset["channels"]
-        return True
+                page = gzip.GzipFile(fileobj=StringIO(page)).read()
+            except IOError as e:
+                self.log.error("ERROR decompressing {0} message: {1}".format(url, e))
+                return None
+        # remember validators for the next conditional request, even if this one was not.
+        if info.get('ETag') or info.get('Last-Modified'):
+            self.validators[url] = (info.get('ETag'), info.get('Last-Modified'))
+        return page
 
-    def _savepickle(self):
-        """Save channel data to pickle."""
+    ########################
+    # STATE SAVE INTERNALS #
+    ########################
 
-        data = {"channels": self.channels}
-        try:
-            datafile = open(conf.supybot.directories.data.dirize(self.name()+".pickle"), 'wb')
+    def _loadstate(self):
+        """Load channels and dedupe data, plus live game state if it was saved recently."""
+
+        self.channels = self.state.channels()
+        self.subs = self.state.subscriptions()
+        # one-time import of channels from the old pickle.
+        if not self.state.get('migrated'):
             try:
-                pickle.dump(data, datafile)
-            finally:
-                datafile.close()
-        except IOError:
+                datafile = open(conf.supybot.directories.data.dirize(self.name()+".pickle"), 'rb')
+                try:
+                    dataset = pickle.load(datafile)
+                finally:
+                    datafile.close()
+                for (k, v) in dataset["channels"].items():
+                    self.channels[k] = v
+                    self.state.setchannel(k, v)
+            except (IOError, EOFError, KeyError, pickle.UnpicklingError):
+                pass
+            self.state.put('migrated', True)
+        # what we've announced. this expires on its own.
+        self.scoredupe.load(self.state.loaddedupe('score'))
+        self.bpsdupe.load(self.state.loaddedupe('bps'))
+        # live state is only any good if it is recent. otherwise we'd diff against a stale scorestrip.
+        live = self.state.get('live')
+        if not live or time.time() - live['saved'] > 600:
             return False
+        self.games = live['games']
+        self.gamesat = live.get('gamesat')
+        self.scorepending = live['scorepending']
+        self.bps = live['bps']
+        (self.nextcheck, self.nextreason) = (live['nextcheck'], live['nextreason'])
+        self.log.info("_loadstate: resuming with {0} games saved {1}s ago.".format(len(self.games or {}), int(time.time() - live['saved'])))
         return True
 
+    def _savestate(self):
+        """Save live game state so a restart can pick up where we left off."""
+
+        self.state.put('live', {'saved': time.time(), 'games': self.games, 'gamesat': self.gamesat, 'scorepending': self.scorepending,
+                                'bps': self.bps, 'nextcheck': self.nextcheck, 'nextreason': self.nextreason})
+
     ############################
     # TIME AND TIME CONVERSION #
     ############################
@@ -136,140 +1001,358 @@ class Football(callbacks.Plugin):
         """We convert our dtstrings in each game into UTC epoch seconds."""
 
         naive = datetime.datetime.strptime(str(dtstring), "%Y%m%d %I:%M %p")  # 20130808 7:30 PM
-        local = pytz.timezone("US/Eastern")  # all of our "times" are in Eastern.
-        local_dt = local.localize(naive, is_dst=None)
+        local_dt = EASTERN.localize(naive, is_dst=None)
         utc_dt = local_dt.astimezone(pytz.UTC) # convert from utc->local(tzstring).
         rtrstr = timegm(utc_dt.utctimetuple())  # return epoch seconds
         return rtrstr
 
     def _utcnow(self):
-        """Calculate Unix timestamp from GMT."""
+        """Calculate Unix timestamp from GMT. Follows the replay clock when replaying."""
 
-        ttuple = datetime.datetime.utcnow().utctimetuple()
-        return timegm(ttuple)
+        return int(self.source.now())
 
     ###########################################
     # INTERNAL CHANNEL POSTING AND DELEGATION #
     ###########################################
 
-    def _post(self, irc, message):
-        """Posts message to a specific channel."""
+    def _invalidateout(self, *args, **kwargs):
+        """Drop the cached output channels. Call whenever channels or prefix settings change."""
 
-        # first check if we have channels.
-        if len(self.channels) == 0:  # bail if none.
-            return
-        # we do have channels. lets go and check where to put what.
-        postchans = [k for (k, v) in self.channels.items() if v == 1]  # only channels with 1 = on.
-        # iterate over each and post.
-        for postchan in postchans:
-            try:
+        self.outchans = None
+
+    def _outchannels(self):
+        """
+        Returns the routing index for enabled channels: {'prefix': channel -> prefix,
+        'anyteam'/'anykind': channels without that filter, 'teams'/'kinds': team or kind -> channels}.
+        Cached until _invalidateout or for a minute (catches per-channel registry edits).
+        """
+
+        if self.outchans is None or time.time() - self.outchansat > 60:
+            outchans = {'prefix': {}, 'anyteam': set(), 'anykind': set(), 'teams': {}, 'kinds': {}}
+            for (k, v) in self.channels.items():
+                if v != 1:  # only channels with 1 = on.
+                    continue
                 # check to see if we should prefix output.
-                if self.registryValue('prefix', postchan):  # we do so lets prefix and output.
-                    message = "{0}{1}".format(self.registryValue('prefixString', postchan), message)
-                irc.queueMsg(ircmsgs.privmsg(postchan, message))
-            except Exception as e:
-                self.log.error("ERROR: _post :: Could not send {0} to {1}. {2}".format(message, postchan, e))
+                if self.registryValue('prefix', k):
+                    outchans['prefix'][k] = self.registryValue('prefixString', k)
+                else:
+                    outchans['prefix'][k] = ""
+                (teams, kinds) = self.subs.get(k, (None, None))
+                for (filt, anykey, idxkey) in ((teams, 'anyteam', 'teams'), (kinds, 'anykind', 'kinds')):
+                    if not filt:
+                        outchans[anykey].add(k)
+                    for f in filt or ():
+                        outchans[idxkey].setdefault(f, set()).add(k)
+            self.outchans = outchans
+            self.outchansat = time.time()
+        return self.outchans
+
+    def _recipients(self, kind, teams=None):
+        """Enabled channels that want kind of event for a game between teams (None: not about a game)."""
+
+        idx = self._outchannels()
+        chans = set(idx['anyteam'])
+        if teams is None:  # not about any team so goes to everyone.
+            chans = set(idx['prefix'])
+        else:
+            for t in teams:
+                chans |= idx['teams'].get(t, set())
+        return chans & (idx['anykind'] | idx['kinds'].get(kind, set()))
+
+    def _wanted(self, game, kind):
+        """Does any channel want kind of event for game? Lets us skip fetches nobody will see."""
+
+        return bool(self._recipients(kind, (game.v, game.h)))
+
+    @timed('post')
+    def _post(self, irc, message, kind='score', piece=None, teams=None):
+        """
+        Queues message for every enabled channel that wants it. Nothing is sent until _flush.
+        kind sets the priority (see PRIORITY) and teams, the (away, home) of the game it is about,
+        are matched against channel subscriptions. If piece is given as (header, text), messages
+        of the same kind waiting together are coalesced into one "header :: text | text" line.
+        """
+
+        with self.outlock:
+            self.outseq += 1
+            prefixes = self._outchannels()['prefix']
+            rendered = {}  # render once per distinct prefix.
+            for postchan in self._recipients(kind, teams):
+                prefix = prefixes[postchan]
+                if prefix not in rendered:
+                    rendered[prefix] = (PRIORITY.get(kind, 5), self.outseq, kind, prefix, "{0}{1}".format(prefix, message), piece)
+                self.outbox.setdefault(postchan, []).append(rendered[prefix])
+
+    def _coalesce(self, entries):
+        """Merge coalescable outbox entries of the same kind. Returns entries in send order."""
+
+        out = []
+        groups = {}  # (kind, prefix) -> entries with pieces.
+        for e in entries:
+            if e[5] is None:
+                out.append(e)
+            else:
+                groups.setdefault((e[2], e[3]), []).append(e)
+        for ((kind, prefix), es) in groups.items():
+            if len(es) == 1:  # nothing to merge with.
+                out.append(es[0][:5] + (None,))
+                continue
+            header = es[0][5][0]
+            chunk = []
+            for e in es:  # keep lines to a sane length for irc.
+                chunk.append(e)
+                if len(" | ".join([c[5][1] for c in chunk])) > 350 and len(chunk) > 1:
+                    out.append((chunk[0][0], chunk[0][1], kind, prefix, "{0}{1} :: {2}".format(prefix, header, " | ".join([c[5][1] for c in chunk[:-1]])), None))
+                    chunk = chunk[-1:]
+            out.append((chunk[0][0], chunk[0][1], kind, prefix, "{0}{1} :: {2}".format(prefix, header, " | ".join([c[5][1] for c in chunk])), None))
+        out.sort(key=lambda e: (e[0], e[1]))
+        return out
+
+    def _flush(self, irc):
+        """
+        Sends what _post has queued, most important first. Each channel has a token bucket
+        (floodBurst lines, refilling one per floodInterval seconds). Whatever does not fit
+        waits and another flush is scheduled.
+        """
+
+        now = time.time()
+        burst = self.registryValue('floodBurst')
+        interval = self.registryValue('floodInterval')
+        with self.outlock:
+            for (postchan, entries) in self.outbox.items():
+                (tokens, last) = self.buckets.get(postchan, (burst, now))
+                tokens = min(burst, tokens + (now - last) / float(interval))
+                entries = self._coalesce(entries)
+                n = min(len(entries), int(tokens))
+                for e in entries[:n]:
+                    try:
+                        irc.queueMsg(ircmsgs.privmsg(postchan, e[4]))
+                    except Exception as err:
+                        self.log.error("ERROR: _flush :: Could not send {0} to {1}. {2}".format(e[4], postchan, err))
+                self.buckets[postchan] = (tokens - n, now)
+                if entries[n:]:  # has to wait.
+                    self.outbox[postchan] = entries[n:]
+                else:
+                    del self.outbox[postchan]
+            waiting = sum([len(v) for v in self.outbox.values()])
+        # come back when there is another token.
+        try:
+            schedule.removeEvent('footballflush')
+        except KeyError:
+            pass
+        if waiting:
+            self.log.info("_flush: {0} line(s) waiting on flood control.".format(waiting))
+            schedule.addEvent(lambda: self._flush(irc), now + interval, name='footballflush')
 
     #################
     # ODDS XML CRON #
     #################
 
+    def _oddsdue(self):
+        """When the odds should next be refreshed (source time). Lines are refreshed every
+        oddsMaxAge seconds and again oddsLead seconds before each upcoming kickoff slot."""
+
+        if not self.oddsfetched:
+            return self._utcnow()
+        due = self.oddsfetched + self.registryValue('oddsMaxAge')
+        lead = self.registryValue('oddsLead')
+        for start in set([v.start for v in (self.games or {}).values() if v.q == "P"]):
+            if start - lead > self.oddsfetched:  # lines would be older than lead at this kickoff.
+                due = min(due, start - lead)
+        return due
+
+    def _oddsjob(self):
+        """footballodds event. Starts a refresh in the background if one is due."""
+
+        if self._utcnow() < self._oddsdue() or self.oddslock.locked():
+            return
+        t = threading.Thread(target=self.checkfootballxml, name="FootballOdds")
+        t.daemon = True
+        t.start()
+
+    @timed('checkfootballxml')
     def checkfootballxml(self):
-        """Function to grab and save the XML."""
-
-        #self.log.info("CacheXML: Running...")
-        if ((not os.path.isfile(self.CACHEFILE)) or (os.path.getsize(self.CACHEFILE) < 1)
-            or (self._utcnow() - os.stat(self.CACHEFILE).st_mtime > 14400)): # under 1 byte, 20 minutes old.
-            self.log.info("checkfootballxml: File does not exist, is too small or old. Fetching.")
-            # setup http fetch.
-            url = b64decode('aHR0cDovL2xpdmVsaW5lcy5iZXRvbmxpbmUuY29tL3N5cy9MaW5lWE1ML0xpdmVMaW5lT2JqWG1sLmFzcD9zcG9ydD1Gb290YmFsbCZzdWJzcG9ydD1ORkw=')
-            html = self._httpget(url)
+        """Function to grab and save the XML. The cache file is replaced atomically and
+        the index swapped in, so readers only ever see whole sets of lines."""
+
+        if not self.oddslock.acquire(False):  # already running.
+            return
+        try:
+            #self.log.info("CacheXML: Running...")
+            html = self._fetch('odds', conditional=bool(self.odds))
+            if html is NOTMODIFIED:  # lines have not moved.
+                self.oddsfetched = self._utcnow()
+                self.log.info("checkfootballxml: XML not modified.")
+                return
             if not html:
                 self.log.error("checkfootballxml: ERROR Fetching XML url.")
                 return
             else:
                 self.log.info("checkfootballxml: Fetched XML URL")
-            # write XML to cache.
-            with open(self.CACHEFILE, 'w') as cache:
-                cache.writelines(html)
+            # write XML to a temp file next to the cache then rename it over the top.
+            (fd, tmp) = tempfile.mkstemp(prefix=os.path.basename(self.CACHEFILE), dir=os.path.dirname(self.CACHEFILE))
+            try:
+                with os.fdopen(fd, 'wb') as cache:
+                    cache.write(html)
+                    cache.flush()
+                    os.fsync(cache.fileno())
+                if os.name == 'nt' and os.path.exists(self.CACHEFILE):  # windows will not rename over a file.
+                    os.remove(self.CACHEFILE)
+                os.rename(tmp, self.CACHEFILE)
                 self.log.info("checkfootballxml: Wrote XML to cache.")
+            except (IOError, OSError), e:
+                self.log.error("checkfootballxml: ERROR writing cache :: {0}".format(e))
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return
+            # parse once here so kickoffs only do lookups.
+            self._loadodds()
+            self.oddsfetched = self._utcnow()
+        finally:
+            self.oddslock.release()
 
     ###################
     # GAMES INTERNALS #
     ###################
 
+    def _iterscorestrip(self, html):
+        """Stream a scorestrip document without building the whole tree.
+        Yields ('g', attrs) for each game and ('b', attrs) for each big play."""
+
+        context = ElementTree.iterparse(StringIO(html), events=('start', 'end'))
+        (event, root) = next(context)  # first start event is the root.
+        for (event, elem) in context:
+            if event != 'end':
+                continue
+            if elem.tag in ('g', 'b'):
+                yield (elem.tag, dict(elem.items()))
+                elem.clear()
+            elif elem.tag in ('gms', 'bps'):  # done with a section. drop it.
+                root.clear()
+
+    @timed('fetchgames')
     def _fetchgames(self):
-        """Returns a list of games."""
+        """Returns a dict of GameState keyed by eid."""
 
-        # main url. this is for regular season stuff. for some reason, they split it.
-        urls = ['aHR0cDovL3d3dy5uZmwuY29tL2xpdmV1cGRhdGUvc2NvcmVzdHJpcC9zcy54bWw=']
-        # if we're in January or February, we have to add an additional url.
-        if datetime.datetime.now().month in (1, 2):  # add in the postseason url.
-            urls.append('aHR0cDovL3d3dy5uZmwuY29tL2xpdmV1cGRhdGUvc2NvcmVzdHJpcC9wb3N0c2Vhc29uL3NzLnhtbA==')
+        # main feed. this is for regular season stuff. for some reason, they split it.
+        feeds = ['scorestrip']
+        # if we're in January or February, we have to add an additional feed.
+        if datetime.datetime.utcfromtimestamp(self._utcnow()).month in (1, 2):  # add in the postseason feed.
+            feeds.append('postseason')
         # g container for our games on output.
         g = {}
-        # now lets grab our urls.
-        for url in urls:
-            url = b64decode(url)  # decode.
-            html = self._httpget(url)  # fetch.
+        # now lets grab our feeds.
+        for feed in feeds:
+            html = self._fetch(feed, conditional=(feed in self.sscache))  # fetch.
+            if html is NOTMODIFIED:  # nothing changed so reuse what we parsed last time.
+                g.update(self.sscache[feed])
+                continue
             if not html:
-                self.log.error("ERROR: Could not _fetchgame url {0}".format(url))
+                self.log.error("ERROR: Could not _fetchgame feed {0}".format(feed))
                 continue
-            # if we get html, load XML.
+            ug = {}  # games for this url.
+            # stream the XML. games (g) and big plays (b) come out as we read them.
             try:
-                tree = ElementTree.fromstring(html)
+                for (tag, tmp) in self._iterscorestrip(html):
+                    if tag == 'g':  # game.
+                        # UTC starttime. these never change for a given eid/t so only work it out once.
+                        start = self.kickoffs.get((tmp['eid'], tmp['t']))
+                        if start is None:
+                            ttime = "{0} {1} PM".format(tmp['eid'][:-2], tmp['t'])  # chop -2 off eid. t = time in 12hr eastern, so add PM.
+                            start = self._convertUTC("{0}".format(ttime))  # convert to UTC.
+                            self.kickoffs[(tmp['eid'], tmp['t'])] = start
+                        # clock is only there when the game is going.
+                        secs = self._gctosec(tmp['k']) if tmp.get('k') else None
+                        # add record (one per game) into dict of games.
+                        ug[tmp['eid']] = GameState(tmp, start, secs)
+                    else:  # big play.
+                        bpsid = tmp.get('id')  # unique id of event.
+                        play = tmp.get('x')  # text of big play.
+                        # we now test if we've injected this into bps or its been printed in bpsdupe.
+                        # we want to 'skip' a few things because they will be referenced in the scoring output.
+                        if ((bpsid not in self.bps) and (not self.bpsdupe.seen(tmp.get('eid'), bpsid)) and ('TD pass' not in play) and ('TD run' not in play)):
+                            self.bps[bpsid] = {'eid': tmp.get('eid'), 'team': tmp.get('abbr'), 'play': play}
             except Exception, e:
                 self.log.error("_fetchgames: ERROR. Could not parse XML :: {0}".format(e))
                 return None
-            # parse games.
-            games = tree.findall('./gms/g')
-            # iterate over all games we find.
-            for game in games:
-                tmp = dict((k, v) for (k, v) in game.items())  # dict comprehension for items.
-                # create UTC starttime in dict.
-                ttime = "{0} {1} PM".format(tmp['eid'][:-2], tmp['t'])  # chop -2 off eid. t = time in 12hr eastern, so add PM.
-                tmp['start'] = self._convertUTC("{0}".format(ttime))  # convert to UTC and inject.
-                # add dict (one per game) into dict of games.
-                g[tmp['eid']] = tmp
-            # now find if there are any BPS.
-            bpss = tree.findall('./bps/b')
-            if len(bpss) != 0:  # we have events.
-                for bps in bpss:  # iterate over each since we might have n+1
-                    bpsid = bps.get('id')  # unique id of event.
-                    play = bps.get('x')  # text of big play.
-                    eid = bps.get('eid')  # eid of "game"
-                    team = bps.get('abbr')  # team name.
-                    # we now test if we've injected this into bps or its been printed in bpsdupe.
-                    # we want to 'skip' a few things because they will be referenced in the scoring output.
-                    if ((bpsid not in self.bps) and (bpsid not in self.bpsdupe) and ('TD pass' not in play) and ('TD run' not in play)):
-                        self.bps[bpsid] = {'eid': eid, 'team': team, 'play': play}
+            # keep the parsed games around in case the next fetch is not modified.
+            self.sscache[feed] = ug
+            g.update(ug)
+        # don't let the kickoff cache outlive the scorestrip by much.
+        if len(self.kickoffs) > 4 * len(g) + 32:
+            self.kickoffs = dict((k, v) for (k, v) in self.kickoffs.items() if k[0] in g)
         # return our dict of dicts (games).
         if len(g) == 0:  # failsafe incase none are here.
             self.log.error("_fetchgames: No games found or processed. Check logs.")
-            # we should add backoff here.
-            return None
+            return None  # the scorestrip breaker handles backing off.
         else:  # we did get games. return.
+            self.gamesat = self._utcnow()
             return g
 
-    def _scoreevent(self, gid):
+    def _fetchgtd(self, gid):
         """
-        Fetch the latest scoring event from a game.
+        Fetch and parse the game-center (gtd) document for a game.
+        Documents are cached for gtdCacheTTL seconds (kept under pollCrunch) so every consumer in a tick shares one download.
+        Once stale, they are revalidated with a conditional request instead of refetched.
         """
 
-        url = b64decode('aHR0cDovL3d3dy5uZmwuY29tL2xpdmV1cGRhdGUvZ2FtZS1jZW50ZXIv') + '%s/%s_gtd.json' % (gid, gid)
-        html = self._httpget(url)  # fetch url.
+        now = self.source.now()
+        # never reuse a document across ticks, or faster polling in crunch time would be for nothing.
+        ttl = min(self.registryValue('gtdCacheTTL'), self.registryValue('pollCrunch')-1)
+        with self.gtdlock:
+            if gid in self.gtdcache and now - self.gtdcache[gid][0] < ttl:
+                self.gtdstats['hits'] += 1
+                return self.gtdcache[gid][1]
+            self.gtdstats['misses'] += 1
+            cached = self.gtdcache.get(gid)
+            # prune anything that nobody has asked for in an hour (game over).
+            for k in [k for (k, v) in self.gtdcache.items() if now - v[0] >= 3600]:
+                del self.gtdcache[k]
+                self.validators.pop(self.source.url('gtd', k), None)
+        # stale or not cached so fetch. if we have a stale copy, only fetch if it changed.
+        html = self._fetch('gtd', gid, conditional=(cached is not None))  # fetch url. None while its breaker is open.
+        if html is NOTMODIFIED:  # reuse the stale copy without parsing.
+            with self.gtdlock:
+                self.gtdcache[gid] = (self.source.now(), cached[1])
+            return cached[1]
         if not html:
-            self.log.error("ERROR: Could not fetch _scoreevent.")
+            self.log.error("ERROR: Could not fetch _fetchgtd for {0}.".format(gid))
             return None
-        # we do have html. lets go.
         try:
             jsonf = json.loads(html.decode('utf-8'))
             base = jsonf[gid]  # base is our id.
+        except Exception, e:
+            self.log.error("_fetchgtd: ERROR :: {0} :: {1}".format(gid, e))
+            return None
+        # index the stats while we have a new document. the leaders command and _finalstats read these.
+        try:
+            stats = GameStats(base, self.source.now())
+        except Exception, e:  # no stats yet (pregame) or a document we do not understand.
+            stats = None
+        # store and return.
+        with self.gtdlock:
+            self.gtdcache[gid] = (self.source.now(), base)
+            if stats:
+                self.gamestats[gid] = stats
+        return base
+
+    @timed('scoreevent')
+    def _scoreevent(self, gid):
+        """
+        Fetch the latest scoring event from a game.
+        """
+
+        base = self._fetchgtd(gid)
+        if not base:
+            self.log.error("ERROR: Could not fetch _scoreevent.")
+            return None
+        # we do have the document. lets go.
+        try:
             scrsummary = base['scrsummary']  # scoring events part.
             if (len(scrsummary) != 0):  # make sure we have events.
                 sc = sorted(dict((int(k),v) for (k, v) in scrsummary.items()))  # sorted list of scoring event items.
                 lastid = str(sc[-1])  # grab the last (-1) event from sorted scoring summary items (in str, base is int)
-                lastev = scrsummary[lastid]  # grab last item from sorted list and grab that entry.
+                lastev = dict(scrsummary[lastid])  # copy the last entry so we don't touch the cached document.
                 lastev['id'] = lastid  # inject the id into the dict returned (str)
                 # now lets check some text before we add or return. type = str, desc = text.
                 if lastev['type'] == "TD":  # we wait for the XPA/2PA (pass/fail)
@@ -280,79 +1363,61 @@ class Football(callbacks.Plugin):
             else:  # no scoring events.
                 return None
         except Exception, e:
-            self.log.error("_scoreevent: ERROR :: {0} :: {1}".format(url ,e))
+            self.log.error("_scoreevent: ERROR :: {0} :: {1}".format(gid, e))
             return None
 
+    @timed('finalstats')
     def _finalstats(self, gid):
         """
         Fetch the final stat lines for each team.
         """
 
-        url = b64decode('aHR0cDovL3d3dy5uZmwuY29tL2xpdmV1cGRhdGUvZ2FtZS1jZW50ZXIv') + '%s/%s_gtd.json' % (gid, gid)
-        html = self._httpget(url)
-        if not html:
-            self.log.error("ERROR: Could not fetch _scoreevent.")
+        base = self._fetchgtd(gid)
+        if not base:
+            self.log.error("ERROR: Could not fetch _finalstats.")
+            return None
+        stats = self.gamestats.get(gid)  # indexed by _fetchgtd.
+        if not stats:
+            self.log.error("_finalstats: GID: {0} ERROR: no stats in the document.".format(gid))
             return None
-        # we do have html. wrap thing in a try/except block.
+        # wrap thing in a try/except block.
         try:
-            jsonf = json.loads(html)
-            # set our base.
-            base = jsonf[gid]
             # create dict for output.
             statlines = {}
             # iterate over home/away.
             for t in ['home', 'away']:
-                # new base
-                b = base[t]['stats']
-                # iterate over each category manually.
-                # qb stats.
-                sb = sorted(b['passing'].iteritems(), key=lambda x: x[1]['yds'], reverse=True)  # leader by yards.
-                qs = "{0} ({1}/{2}) TD: {3} INT: {4} YDS: {5}".format(sb[0][1]['name'].encode('utf-8'), sb[0][1]['cmp'], sb[0][1]['att'], sb[0][1]['tds'], sb[0][1]['ints'], sb[0][1]['yds'])
-                # rb stats.
-                sb = sorted(b['rushing'].iteritems(), key=lambda x: x[1]['yds'], reverse=True)  # leader by yards.
-                rs = "{0} YDS: {1} ATT: {2} TD: {3}".format(sb[0][1]['name'].encode('utf-8'), sb[0][1]['yds'], sb[0][1]['att'], sb[0][1]['tds'])
-                # passing stats.
-                sb = sorted(b['receiving'].iteritems(), key=lambda x: x[1]['yds'], reverse=True)  # leader by yards.
-                ps = "{0} YDS: {1} TD: {2}".format(sb[0][1]['name'].encode('utf-8'), sb[0][1]['yds'], sb[0][1]['tds'])
-                # team stats.
-                ts = "TO: {0} YDS: {1} FD: {2} TOP: {3}".format(b['team']['trnovr'], b['team']['totyds'], b['team']['totfd'], b['team']['top'])
+                # leaders by yards in each category, then team stats.
+                qs = stats.line(t, 'passing')
+                rs = stats.line(t, 'rushing')
+                ps = stats.line(t, 'receiving')
+                ts = stats.totals(t)
                 # now that we're done, append the temp dict into statlines for output.
-                statlines[base[t]['abbr']] = "{0}  {1}: {2}  {3}: {4}  {5}: {6}".format(ts, ircutils.bold('Passing'), qs, ircutils.bold('Rushing'), rs, ircutils.bold('Receiving'), ps)
+                statlines[stats.sides[t]['abbr']] = "{0}  {1}: {2}  {3}: {4}  {5}: {6}".format(ts, ircutils.bold('Passing'), qs, ircutils.bold('Rushing'), rs, ircutils.bold('Receiving'), ps)
             # return now.
             return statlines
         except Exception, e:  # something went wrong above.
             self.log.error("_finalstats: GID: {0} ERROR: {1}".format(gid, e))
             return None
 
-    def _bettingline(self, a, h):
-        """See if we can fetch some betting information about the game."""
+    def _loadodds(self):
+        """Parse the cached odds XML into an index of full-game lines keyed by (away, home).
+        The index is rebuilt only when the cache file's mtime changes."""
 
         try:
-            # need full team names to compare.
-            transtable = {
-                'DEN':'Denver Broncos', 'NE':'New England Patriots', 'HOU':'Houston Texans', 'SF':'San Francisco 49ers',
-                'GB':'Green Bay Packers', 'SEA':'Seattle Seahawks', 'ATL':'Atlanta Falcons', 'NO':'New Orleans Saints',
-                'PIT':'Pittsburgh Steelers', 'BAL':'Baltimore Ravens', 'CIN':'Cincinnati Bengals', 'NYG':'New York Giants',
-                'DAL':'Dallas Cowboys', 'CHI':'Chicago Bears', 'IND':'Indianapolis Colts', 'WAS':'Washington Redskins',
-                'PHI':'Philadelphia Eagles', 'CAR':'Carolina Panthers', 'MIA':'Miami Dolphins', 'SD':'San Diego Chargers',
-                'TB':'Tampa Bay Buccaneers', 'KC':'Kansas City Chiefs', 'DET':'Detroit Lions', 'MIN':'Minnesota Vikings',
-                'STL':'St. Louis Rams', 'CLE':'Cleveland Browns', 'TEN':'Tennessee Titans', 'BUF':'Buffalo Bills',
-                'ARI':'Arizona Cardinals', 'NYJ':'New York Jets', 'OAK':'Oakland Raiders', 'JAC':'Jacksonville Jaguars',
-                'JAX':'Jacksonville Jaguars'}
-            # setup our container. we'll return the first.
-            odds = []
-            # now lets parse the XML.
+            mtime = os.stat(self.CACHEFILE).st_mtime
+        except OSError:  # no cache file yet.
+            return self.odds
+        if mtime == self.oddsmtime:  # index is current.
+            return self.odds
+        try:
+            tree = ElementTree.parse(self.CACHEFILE)
+        except Exception, e:
+            self.log.error("_loadodds :: ERROR parsing XML file :: {0}".format(e))
+            return self.odds
+        odds = {}
+        # bo's xml is odd because they post multiple events even for the same game.
+        for e in tree.findall('event'):
             try:
-                tree = ElementTree.parse(self.CACHEFILE)
-            except Exception, e:
-                self.log.error("_bettingline :: ERROR parsing XML file :: {0}".format(e))
-                return None
-            # find the events.
-            ev = tree.findall('event')
-            # log
-            self.log.info("_bettingline: Trying to fetch odds for {0} v. {1}".format(transtable[a], transtable[h]))
-            # iterate through. bo's xml is odd because they post multiple events even for the same game.
-            for e in ev:  # this is ugly but it works.
                 tms = e.findall('participant')
                 away = tms[0].find('participant_name').text
                 awayml = tms[0].find('odds/moneyline').text
@@ -361,18 +1426,42 @@ class Football(callbacks.Plugin):
                 homespread = e.find('period/spread/spread_home').text
                 total = e.find('period/total/total_points').text
                 period = e.find('period/period_description').text
-                # due to all the entries for half lines, etc, we have to match all of these. it's disgusting but it worked. we append each "match"
-                if transtable[a] == away and transtable[h] == home and period and period == "Game" and awayml and homeml and homespread and total:
-                    odds.append({'awayml':awayml, 'homeml':homeml, 'spread':homespread, 'total':total})
-            # now, out of the foor loop, lets make sure we have something.
-            if len(odds) != 0:  # we got something so lets return.
-                return odds[0]  # return first
-            else:  # something broke so we return none.
-                return None
+            except (AttributeError, IndexError):  # incomplete event.
+                continue
+            # due to all the entries for half lines, etc, we only want full-game lines with everything filled in. first one wins.
+            if period == "Game" and awayml and homeml and homespread and total and (away, home) not in odds:
+                odds[(away, home)] = {'awayml':awayml, 'homeml':homeml, 'spread':homespread, 'total':total}
+        self.log.info("_loadodds: indexed {0} lines.".format(len(odds)))
+        # swap in.
+        self.odds = odds
+        self.oddsmtime = mtime
+        return odds
+
+    @timed('bettingline')
+    def _bettingline(self, a, h):
+        """See if we can fetch some betting information about the game."""
+
+        try:
+            self.log.info("_bettingline: Trying to fetch odds for {0} v. {1}".format(TEAMNAMES[a], TEAMNAMES[h]))
+            return self.odds.get((TEAMNAMES[a], TEAMNAMES[h]))  # kept current by checkfootballxml.
         except Exception, e:  # something went wrong..
-            self.log.error("_bettingline :: ERROR fetching odds for {0} v. 1{} :: {2}".format(a, h, e))
+            self.log.error("_bettingline :: ERROR fetching odds for {0} v. {1} :: {2}".format(a, h, e))
             return None
 
+    def _formatline(self, a, h, bl):
+        """"AWAY v. HOME[spread] :: ml: a/h :: o/u: total" for a line from _bettingline, or just the teams."""
+
+        if bl:  # we did get something back.
+            bstr = "ml: {0}/{1} :: o/u: {2}".format(bl['awayml'], bl['homeml'], bl['total'])  # format betting part.
+            # lets format the spread so it looks better.
+            if not bl['spread'].startswith('-'):  # away favored.
+                spread = "+{0}".format(bl['spread'])
+            else:  # home favored.
+                spread = "{0}".format(bl['spread'])
+            return "{0} v. {1}[{2}] :: {3}".format(a, h, spread, bstr)
+        else:  # we did not get something back. post normal starting line.
+            return "{0} v. {1}".format(a, h)
+
     def _gctosec(self, s):
         """Convert seconds of clock into an integer of seconds remaining."""
 
@@ -403,10 +1492,316 @@ class Football(callbacks.Plugin):
         else:  # tie.
             return "{0} {1} {2} {3}".format(awayteam, awayscore, hometeam, homescore)
 
+    ###########################
+    # CHECKFOOTBALL INTERNALS #
+    ###########################
+
+    def _nextinterval(self, games):
+        """
+        Work out how long until the next check from the state of the games.
+        Returns (seconds, reason).
+        """
+
+        statuses = set([g.q for g in games.values()])
+        # possible statuses: F/FO = game over, P = pending, H = halftime. Rest are active games.
+        live = [g for g in games.values() if g.qtr]
+        if live:
+            # two-minute situations and overtime are where things happen fast.
+            crunch = [g for g in live if g.qtr == 5 or (g.qtr in (2, 4) and g.secs is not None and g.secs <= 150)]
+            if crunch:
+                return (self.registryValue('pollCrunch'), "{0} game(s) in crunch time".format(len(crunch)))
+            return (self.registryValue('pollLive'), "{0} game(s) live".format(len(live)))
+        elif 'H' in statuses:  # only halftime (plus pending/final).
+            return (self.registryValue('pollHalftime'), "only halftime games")
+        elif 'P' in statuses:  # we have pending games left in here.
+            utcnow = self._utcnow()
+            firstgametime = sorted([g.start for g in games.values() if g.q == "P"])[0]  # sort, first item.
+            if utcnow < firstgametime:  # future kickoff. check again then (or in 6 hours so we see scorestrip updates).
+                return (min(firstgametime-utcnow, 21600), "next kickoff in {0}s".format(firstgametime-utcnow))
+            elif utcnow-firstgametime < 3601:  # kickoff was under an hour ago. should start any second.
+                return (self.registryValue('pollLive'), "kickoff was {0}s ago".format(utcnow-firstgametime))
+            else:  # older than an hour. lets holdoff for 5m.
+                return (300, "pending game kickoff is over an hour old")
+        else:  # no active games and no future games. I assume all games are final then.
+            return (3600, "no active or future games")
+
+    def _diffgames(self, games1, games2):
+        """
+        Compare two sets of games. Returns a dict of eid -> set of changed fields
+        (see GameState.FIELDS) for games that are in both and actually changed.
+        """
+
+        changes = {}
+        for (k, old) in games1.items():
+            new = games2.get(k)
+            if not new:
+                continue
+            (a, b) = (old.signature(), new.signature())
+            if a == b:  # cheap check first. nothing we care about moved.
+                continue
+            changes[k] = set(f for (f, x, y) in zip(GameState.FIELDS, a, b) if x != y)
+        return changes
+
+    def _scoregate(self, games, changes):
+        """
+        Pick which games need their scoring play fetched. A game is picked when its score
+        changes, whatever its status (a TD before the half waits on its PAT through halftime),
+        and stays picked until we post its play or scoreRetryWindow runs out.
+        """
+
+        now = self.source.now()
+        for (k, fields) in changes.items():
+            if 'score' in fields and k in games:
+                self.scorepending[k] = now + self.registryValue('scoreRetryWindow')
+        # drop anything that has waited too long or fell off the scorestrip.
+        for k in [k for (k, t) in self.scorepending.items() if t < now or k not in games]:
+            self.log.info("_scoregate: gave up waiting on a scoring play in {0}".format(k))
+            del self.scorepending[k]
+            if k in games and games[k].q in ("F", "FO"):  # the final rule left these for us.
+                self.scoredupe.purge(k)
+        return [k for k in games if k in self.scorepending]
+
+    def _evscoring(self, irc, k, new, scev):
+        """Scoring event for an active game. Returns True if we posted one."""
+
+        if scev:  # we got one back instead of None.
+            if not self.scoredupe.seen(k, scev['id']):  # event is unique.
+                self.log.info("Should fire scoring event in {0}".format(k))
+                l = self._boldleader(new.v, new.vs, new.h, new.hs)  # bold leader
+                qtr = self._qtr(new.q)
+                mstr = "{0} :: {1} :: {2} :: {3} ({4} {5})".format(l, scev['team'], scev['type'], scev['desc'], qtr, new.k)
+                self.scoredupe.add(k, scev['id'])  # we add the event so we don't repeat.
+                # now post event.
+                self._post(irc, mstr, 'score', teams=(new.v, new.h))
+                return True
+        return False
+
+    def _isactive(self, old, new):
+        """Was the game going last tick (and still going or just finished)?"""
+
+        return bool(old.qtr and (new.qtr or new.q in ("H", "F", "FO")))
+
+    def _evredzone(self, irc, k, old, new):
+        """Team enters the redzone."""
+
+        if not self._isactive(old, new):
+            return
+        if ((not old.rz) and (new.rz)):
+            self.log.info("Should fire redzone event in {0}".format(k))
+            # must have pos team. we do this as a sanity check because w/o the team it's pointless.
+            if new.p:
+                l = self._boldleader(new.v, new.vs, new.h, new.hs)
+                qtr = self._qtr(new.q)
+                mstr = "{0} :: {1} is in the {2} ({3} {4})".format(l, ircutils.bold(new.p), ircutils.mircColor('redzone', 'red'), qtr, new.k)
+                # now post event.
+                self._post(irc, mstr, 'redzone', teams=(new.v, new.h))
+
+    def _evtwominute(self, irc, k, old, new):
+        """2 minute warning."""
+
+        if not self._isactive(old, new):
+            return
+        if ((new.qtr in (2, 4)) and (old.secs is not None) and (new.secs is not None)
+            and (old.secs > 120) and (new.secs <= 120)):
+            self.log.info("should fire 2 minute warning in {0}".format(k))
+            l = self._boldleader(new.v, new.vs, new.h, new.hs)
+            qtr = self._qtr(new.q)
+            mstr = "{0} :: {1} ({2} qtr {3})".format(l, ircutils.bold("2 minute warning."), qtr, new.k)
+            # now post event.
+            self._post(irc, mstr, 'twominute', teams=(new.v, new.h))
+
+    def _evstatus(self, irc, k, old, new):
+        """Events that occur with "quarter" (status) changes."""
+
+        # GAME GOES FINAL.
+        if ((old.q in ("4", "5")) and (new.q in ("F", "FO"))):
+            self.log.info("Should fire final of game {0}".format(k))
+            l = self._boldleader(new.v, new.vs, new.h, new.hs)
+            # if we "final" overtime, it is FO, which looks ugly. A small fix.
+            if new.q == "FO":
+                fstr = "F/OT"
+            else:  # regular "F" for final.
+                fstr = "F"
+            mstr = "{0} :: {1}".format(l, ircutils.mircColor(fstr, 'red'))
+            # now post event.
+            self._post(irc, mstr, 'final', teams=(new.v, new.h))
+            # try and grab finalstats for game, unless nobody would get them.
+            if self._wanted(new, 'finalstats'):
+                fs = self._finalstats(k)
+                if fs:  # we got fs.
+                    for (y, z) in fs.items():  # iterate over each team.
+                        fss = "{0} :: {1}".format(y, z)  # format string.
+                        # now post event.
+                        self._post(irc, fss, 'finalstats', teams=(new.v, new.h))
+                else:  # we didn't get it.
+                    self.log.error("checkfootball: failed to get fs for {0}".format(k))
+            # no more scoring in this game so forget its events. unless we are still waiting on
+            # its last play (see _scoregate), or a game-center document that lags would repost one.
+            if k not in self.scorepending:
+                self.scoredupe.purge(k)
+        # GAME START (KICKOFF).
+        if ((old.q == "P") and (new.q == "1")):
+            self.log.info("Should fire start of game {0}".format(k))
+            # first, lets see if we can fetch betting information.
+            game = self._formatline(old.v, old.h, self._bettingline(old.v, old.h))  # away/home.
+            ko = ircutils.mircColor('KICKOFF', 'green')  # ko part.
+            mstr = "{0} :: {1}".format(game, ko)
+            # now post event. kickoffs in the same tick get rolled into one line.
+            self._post(irc, mstr, 'kickoff', (ko, game), (old.v, old.h))
+        # GAME GOES TO HALFTIME.
+        if ((old.q == "2") and (new.q == "H")):
+            l = self._boldleader(new.v, new.vs, new.h, new.hs)
+            mstr = "{0} :: {1}".format(l, ircutils.mircColor('HALFTIME', 'yellow'))
+            # now post event.
+            self._post(irc, mstr, 'status', teams=(new.v, new.h))
+        # GAME COMES OUT OF HALFTIME.
+        if ((old.q == "H") and (new.q == "3")):
+            l = self._boldleader(new.v, new.vs, new.h, new.hs)
+            s = ircutils.mircColor('Start of 3rd qtr', 'green')
+            mstr = "{0} :: {1}".format(l, s)
+            # now post event.
+            self._post(irc, mstr, 'status', teams=(new.v, new.h))
+        # START OF 2ND/4TH QUARTER.
+        if (((old.q == "1") and (new.q == "2")) or ((old.q == "3") and (new.q == "4"))):
+            self.log.info("Should fire start of 2nd or 4th qtr in {0}".format(k))
+            l = self._boldleader(new.v, new.vs, new.h, new.hs)
+            q = "Start of {0} qtr".format(self._qtr(new.q))
+            mstr = "{0} :: {1}".format(l, ircutils.mircColor(q, 'green'))
+            # now post event.
+            self._post(irc, mstr, 'status', teams=(new.v, new.h))
+        # GAME GOES INTO OVERTIME.
+        if ((old.q == "4") and (new.q == "5")):
+            self.log.info("Should fire overtime in {0}".format(k))
+            mstr = "{0} {1} {2} {3} :: {4}".format(new.v, new.vs, new.h, new.hs, ircutils.bold("Overtime"))
+            # now post event.
+            self._post(irc, mstr, 'status', teams=(new.v, new.h))
+
+    ###################
+    # QUERY INTERNALS #
+    ###################
+
+    def _age(self, t):
+        """How long ago source time t was, for replies. ie: 25s ago."""
+
+        if not t:
+            return "never"
+        secs = max(0, int(self._utcnow() - t))
+        if secs < 120:
+            return "{0}s ago".format(secs)
+        elif secs < 7200:
+            return "{0}m ago".format(secs // 60)
+        return "{0}h ago".format(secs // 3600)
+
+    def _gamestatus(self, g):
+        """One game from self.games for the query commands."""
+
+        if g.q == "P":  # not started.
+            return "{0} v. {1} :: {2} {3} ET".format(g.v, g.h, g.d, g.t)
+        l = self._boldleader(g.v, g.vs, g.h, g.hs)
+        if g.q in ("F", "FO"):
+            return "{0} :: {1}".format(l, "F/OT" if g.q == "FO" else "F")
+        if g.q == "H":
+            return "{0} :: Halftime".format(l)
+        status = "{0} :: {1} {2}".format(l, self._qtr(g.q), g.k or "")
+        if g.rz and g.p:  # driving.
+            status += " :: {0} in the redzone".format(g.p)
+        return status
+
+    def _findgame(self, irc, team):
+        """The game in self.games team is playing in. Replies with an error and returns None if there is not one."""
+
+        team = team.upper()
+        if team not in TEAMNAMES:
+            irc.reply("ERROR: '{0}' is not a valid team. Must be one of: {1}".format(team, " | ".join(sorted(TEAMNAMES))))
+            return None
+        for g in (self.games or {}).values():
+            if team in (g.v, g.h):
+                return g
+        irc.reply("ERROR: I do not have a game for {0} on the scorestrip.".format(team))
+        return None
+
     ###################
     # PUBLIC COMMANDS #
     ###################
 
+    def footballscores(self, irc, msg, args):
+        """
+        Scoreboard for every game on the scorestrip. Answered from what we already have, never a fetch.
+        """
+
+        if self._warmingup(irc):
+            return
+        games = sorted((self.games or {}).values(), key=lambda g: (g.start, g.eid))
+        if not games:
+            irc.reply("ERROR: I do not have any games right now.")
+            return
+        irc.reply("{0} (as of {1})".format(" | ".join([self._gamestatus(g) for g in games]), self._age(self.gamesat)))
+
+    footballscores = wrap(footballscores)
+
+    def footballgame(self, irc, msg, args, team):
+        """<team>
+
+        Status of team's game. Answered from what we already have, never a fetch.
+        Ex: NE
+        """
+
+        if self._warmingup(irc):
+            return
+        g = self._findgame(irc, team)
+        if g:
+            irc.reply("{0} (as of {1})".format(self._gamestatus(g), self._age(self.gamesat)))
+
+    footballgame = wrap(footballgame, [('somethingWithoutSpaces')])
+
+    def footballline(self, irc, msg, args, team):
+        """<team>
+
+        Current betting line for team's game. Answered from the cached odds, never a fetch.
+        Ex: NE
+        """
+
+        if self._warmingup(irc):
+            return
+        g = self._findgame(irc, team)
+        if not g:
+            return
+        bl = self._bettingline(g.v, g.h)
+        if not bl:
+            irc.reply("ERROR: I do not have a line for {0} v. {1}.".format(g.v, g.h))
+            return
+        irc.reply("{0} (lines as of {1})".format(self._formatline(g.v, g.h, bl), self._age(self.oddsfetched)))
+
+    footballline = wrap(footballline, [('somethingWithoutSpaces')])
+
+    def footballleaders(self, irc, msg, args, team):
+        """<team>
+
+        Passing, rushing and receiving leaders and team totals for team's game so far.
+        Uses the game-center data we already fetched for scoring, never a fetch of its own.
+        Ex: NE
+        """
+
+        if self._warmingup(irc):
+            return
+        g = self._findgame(irc, team)
+        if not g:
+            return
+        stats = self.gamestats.get(g.eid)
+        if not stats:
+            irc.reply("ERROR: I do not have stats for {0} v. {1} yet.".format(g.v, g.h))
+            return
+        side = stats.side(team.upper()) or ('away' if team.upper() == g.v else 'home')
+        out = []
+        for cat in GameStats.CATEGORIES:
+            lines = []
+            for i in range(len(stats.sides[side]['leaders'][cat])):
+                lines.append(stats.line(side, cat, i))
+            out.append("{0}: {1}".format(ircutils.bold(cat.title()), " | ".join(lines) or "none"))
+        irc.reply("{0} :: {1} :: {2} (as of {3})".format(ircutils.bold(team.upper()), stats.totals(side), " :: ".join(out), self._age(stats.when)))
+
+    footballleaders = wrap(footballleaders, [('somethingWithoutSpaces')])
+
     def footballchannel(self, irc, msg, args, op, optchannel):
         """<add #channel|del #channel|list>
 
@@ -415,6 +1810,9 @@ class Football(callbacks.Plugin):
         Ex: add #channel OR del #channel OR list
         """
 
+        # channels are loaded in _warmup.
+        if self._warmingup(irc, self.stateready):
+            return
         # first, lower operation.
         op = op.lower()
         # next, make sure op is valid.
@@ -437,21 +1835,26 @@ class Football(callbacks.Plugin):
         # now we handle each op individually.
         if op == 'add':  # add output to channel.
             self.channels[optchannel] = 1  # add it and on.
-            self._savepickle()  # save.
+            self._invalidateout()
+            self.state.setchannel(optchannel, 1)  # save.
             irc.reply("I have enabled FOOTBALL status updates on {0}".format(optchannel))
         elif op == 'list':  # list channels
             if len(self.channels) == 0:  # no channels.
                 irc.reply("ERROR: I have no active channels defined. Please use the footballchannel add operation to add a channel.")
             else:   # we do have channels.
                 for (k, v) in self.channels.items():  # iterate through and output translated keys.
+                    (teams, kinds) = self.subs.get(k, (None, None))
+                    subs = "".join([" :: {0}: {1}".format(n, " ".join(sorted(f))) for (n, f) in (('teams', teams), ('events', kinds)) if f])
                     if v == 0:  # swap 0/1 into OFF/ON.
-                        irc.reply("{0} :: OFF".format(k))
+                        irc.reply("{0} :: OFF{1}".format(k, subs))
                     elif v == 1:
-                        irc.reply("{0} :: ON".format(k))
+                        irc.reply("{0} :: ON{1}".format(k, subs))
         elif op == 'del':  # delete an item from channels.
             if optchannel in self.channels:  # id is already in.
                 del self.channels[optchannel]  # remove it.
-                self._savepickle()  # save.
+                self.subs.pop(optchannel, None)
+                self._invalidateout()
+                self.state.delchannel(optchannel)  # save.
                 irc.reply("I have successfully removed {0}".format(optchannel))
             else:  # id was NOT in there.
                 irc.reply("ERROR: I do not have {0} in {1}".format(optarg, optchannel))
@@ -463,6 +1866,8 @@ class Football(callbacks.Plugin):
         Enable FOOTBALL scoring in channel.
         """
 
+        if self._warmingup(irc, self.stateready):
+            return
         # channel
         channel = channel.lower()
         # check if op.
@@ -472,6 +1877,8 @@ class Football(callbacks.Plugin):
         # check now.
         if channel in self.channels:
             self.channels[channel] = 1
+            self._invalidateout()
+            self.state.setchannel(channel, 1)
             irc.reply("I have turned on FOOTBALL livescoring for {0}".format(channel))
         else:
             irc.reply("ERROR: {0} is not in any known channels.".format(channel))
@@ -483,6 +1890,8 @@ class Football(callbacks.Plugin):
         Disable FOOTBALL scoring in channel.
         """
 
+        if self._warmingup(irc, self.stateready):
+            return
         # channel
         channel = channel.lower()
         # check if op.
@@ -492,12 +1901,80 @@ class Football(callbacks.Plugin):
         # check now.
         if channel in self.channels:
             self.channels[channel] = 0
+            self._invalidateout()
+            self.state.setchannel(channel, 0)
             irc.reply("I have turned off FOOTBALL livescoring for {0}".format(channel))
         else:
             irc.reply("ERROR: {0} is not in any known channels.".format(channel))
 
     footballoff = wrap(footballoff, [('channel')])
 
+    def _subscribe(self, irc, msg, channel, which, values, valid):
+        """footballteams/footballevents. which is 0 for teams, 1 for event kinds."""
+
+        if self._warmingup(irc, self.stateready):
+            return
+        channel = channel.lower()
+        name = ('teams', 'events')[which]
+        if channel not in self.channels:
+            irc.reply("ERROR: {0} is not in any known channels.".format(channel))
+            return
+        subs = list(self.subs.get(channel, (frozenset(), frozenset())))
+        if not values:  # show.
+            irc.reply("{0} gets {1}: {2}".format(channel, name, " ".join(sorted(subs[which])) or "all"))
+            return
+        # check if op.
+        if not irc.state.channels[channel].isOp(msg.nick):
+            irc.reply("ERROR: You must be an op in this channel for this command to work.")
+            return
+        if [v for v in values if v.lower() == 'all']:
+            values = frozenset()
+        else:
+            values = frozenset(values)
+            invalid = [v for v in values if v not in valid]
+            if invalid:
+                irc.reply("ERROR: {0} not valid. Must be one of: {1}".format(" | ".join(invalid), " | ".join(sorted(valid))))
+                return
+        subs[which] = values
+        self.subs[channel] = tuple(subs)
+        self._invalidateout()
+        self.state.setsubscriptions(channel, subs[0], subs[1])
+        irc.reply("{0} now gets {1}: {2}".format(channel, name, " ".join(sorted(values)) or "all"))
+
+    def footballteams(self, irc, msg, args, channel, teams):
+        """[#channel] [team ...|all]
+
+        Only announce games involving these teams in channel. all goes back to every game.
+        With no teams, shows what channel gets.
+        Ex: NE NYJ
+        """
+
+        self._subscribe(irc, msg, channel, 0, [t.upper() for t in teams], TEAMNAMES)
+
+    footballteams = wrap(footballteams, [('channel'), any('somethingWithoutSpaces')])
+
+    def footballevents(self, irc, msg, args, channel, kinds):
+        """[#channel] [event ...|all]
+
+        Only announce these kinds of events in channel. all goes back to every kind.
+        With no events, shows what channel gets.
+        Ex: score final kickoff
+        """
+
+        self._subscribe(irc, msg, channel, 1, [k.lower() for k in kinds], PRIORITY)
+
+    footballevents = wrap(footballevents, [('channel'), any('somethingWithoutSpaces')])
+
+    def footballstats(self, irc, msg, args):
+        """
+        Show where checkfootball spends its time, and cache/connection counters.
+        """
+
+        for line in self._statslines():
+            irc.reply(line)
+
+    footballstats = wrap(footballstats, [('checkCapability', 'admin')])
+
     #def checkfootball(self, irc, msg, args):
     def checkfootball(self, irc):
         """
@@ -505,16 +1982,9 @@ class Football(callbacks.Plugin):
         """
 
         self.log.info("Starting..")
-        # first, run our XML cron.
-        self.checkfootballxml()
-        # before anything, check if nextcheck is set and is in the future.
-        if self.nextcheck:  # set
-            if self.nextcheck > self._utcnow():  # in the future so we backoff.
-                self.log.info("checkfootball: nextcheck is in the future. {0} from now.".format(self.nextcheck-self._utcnow()))
-                return
-            else:  # in the past so lets reset it. this means that we've reached the time where firstgametime should begin.
-                self.log.info("checkfootball: nextcheck has passed. we are resetting and continuing normal operations.")
-                self.nextcheck = None
+        # if we bail out below, try again at the normal pace.
+        self.nextcheck = self._utcnow()+self.registryValue('pollLive')
+        self.nextreason = "retrying after no games or a failed fetch"
         # we must have initial games. bail if not.
         if not self.games:
             self.games = self._fetchgames()
@@ -529,172 +1999,78 @@ class Football(callbacks.Plugin):
         games2 = self._fetchgames()
         if not games2:  # something went wrong so we bail.
             self.log.error("checkfootball: fetching games2 failed.")
+            reopen = self.breakers.until(('scorestrip', None))
+            if reopen and reopen-self._utcnow() > self.registryValue('pollLive'):  # no point checking before it will let us.
+                self.nextcheck = int(reopen)+1
+                self.nextreason = "scorestrip breaker open"
             return
-        # self.log.info("Main handler.")
+        # work out which games changed, and how, since last tick.
+        changes = self._diffgames(games1, games2)
+        # SCORING EVENTS.
+        # we poll the json page for active games. with scoreGating, only for games whose score moved.
+        # these are fetched all at once and results come back keyed by gid.
+        activegids = [k for (k, v) in games1.items() if k in games2 and self._isactive(v, games2[k])]
+        if self.registryValue('scoreGating'):
+            scoregids = self._scoregate(games2, changes)
+        else:  # lazy but works.
+            scoregids = activegids
+        # no point fetching scoring for games nobody gets scoring for.
+        unwanted = [k for k in scoregids if not self._wanted(games2[k], 'score')]
+        for k in unwanted:
+            self.scorepending.pop(k, None)
+        scoregids = [k for k in scoregids if k not in unwanted]
+        # each game is handled as soon as its fetch finishes so a slow one does not hold up the rest.
+        done = 0
+        for (k, scev) in self.fetchpool.imap(self._scoreevent, scoregids, self.registryValue('poolTimeout')):
+            done += 1
+            if self._evscoring(irc, k, games2[k], scev):  # None unless there is a scoring event.
+                self.scorepending.pop(k, None)  # found it. stop looking.
+        if done != len(scoregids):  # some games did not come back before the deadline. scorepending retries them.
+            self.log.info("checkfootball: {0}/{1} scoring fetches finished before the deadline.".format(done, len(scoregids)))
         # main handler for event changes.
-        # we go through each event, compare, and post according to the changes.
+        # games that did not change are skipped and the rest only run the rules for the fields that did.
         for (k, v) in games1.items():  # iterate over games.
-            if k in games2:  # must mate keys between games1 and games2.
-                # FIRST, ACTIVE GAME EVENTS ONLY.
-                if (v['q'] in ("1", "2", "3", "4", "5") and (games2[k]['q'] in ("1", "2", "3", "4", "5", "H", "F", "FO"))):
-                    # make sure game is in scoredict like if/when we reload.
-                    if k not in self.scoredict:
-                        self.scoredict[k] = {}
-                    # SCORING EVENT.
-                    # what we do is poll each json page for each active game. it's lazy but works.
-                    scev = self._scoreevent(k)  # returns None unless there is a scoring event.
-                    if scev:  # we got one back instead of None.
-                        if scev['id'] not in self.scoredict[k]:  # event is unique.
-                            self.log.info("Should fire scoring event in {0}".format(k))
-                            l = self._boldleader(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'])  # bold leader
-                            qtr = self._qtr(games2[k]['q'])
-                            mstr = "{0} :: {1} :: {2} :: {3} ({4} {5})".format(l, scev['team'], scev['type'], scev['desc'], qtr, games2[k]['k'])
-                            self.scoredict[k] = scev['id']  # we add the event so we don't repeat.
-                            # now post event.
-                            self._post(irc, mstr)
-                    # TEAM ENTERS REDZONE.
-                    if ((v['rz'] == "0") and (games2[k]['rz'] == "1")):
-                        self.log.info("Should fire redzone event in {0}".format(k))
-                        # must have pos team. we do this as a sanity check because w/o the team it's pointless.
-                        if 'p' in games2[k]:
-                            l = self._boldleader(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'])
-                            qtr = self._qtr(games2[k]['q'])
-                            mstr = "{0} :: {1} is in the {2} ({3} {4})".format(l, ircutils.bold(games2[k]['p']), ircutils.mircColor('redzone', 'red'), qtr, games2[k]['k'])
-                            # now post event.
-                            self._post(irc, mstr)
-                    # 2 MINUTE WARNING.
-                    if ((games2[k]['q'] in ("2", "4")) and (self._gctosec(v['k']) > 120) and (self._gctosec(games2[k]['k']) <= 120)):
-                        self.log.info("should fire 2 minute warning in {0}".format(k))
-                        l = self._boldleader(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'])
-                        qtr = self._qtr(games2[k]['q'])
-                        mstr = "{0} :: {1} ({2} qtr {3})".format(l, ircutils.bold("2 minute warning."), qtr, games2[k]['k'])
-                        # now post event.
-                        self._post(irc, mstr)
-                # EVENTS THAT OCCUR WITH "QUARTER" (STATUS) CHANGES.
-                if (v['q'] != games2[k]['q']):
-                    # GAME GOES FINAL.
-                    if ((v['q'] in ("4", "5")) and (games2[k]['q'] in ("F", "FO"))):
-                        self.log.info("Should fire final of game {0}".format(k))
-                        l = self._boldleader(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'])
-                        # if we "final" overtime, it is FO, which looks ugly. A small fix.
-                        if games2[k]['q'] == "FO":
-                            fstr = "F/OT"
-                        else:  # regular "F" for final.
-                            fstr = "F"
-                        mstr = "{0} :: {1}".format(l, ircutils.mircColor(fstr, 'red'))
-                        # now post event.
-                        self._post(irc, mstr)
-                        # try and grab finalstats for game.
-                        fs = self._finalstats(k)
-                        if fs:  # we got fs.
-                            for (y, z) in fs.items():  # iterate over each team.
-                                fss = "{0} :: {1}".format(y, z)  # format string.
-                                # now post event.
-                                self._post(irc, fss)
-                        else:  # we didn't get it.
-                            self.log.error("checkfootball: failed to get fs for {0}".format(k))
-                        # delete item from scoredict now that we're final.
-                        if k in self.scoredict:
-                            del self.scoredict[k]
-                        else:
-                            self.log.info("checkfootball: error {0} was not in scoredict when we went final".format(k))
-                    # GAME START (KICKOFF).
-                    if ((v['q'] == "P") and (games2[k]['q'] == "1")):
-                        self.log.info("Should fire start of game {0}".format(k))
-                        # first, lets see if we can fetch betting information.
-                        bl = self._bettingline(v['v'], v['h'])  # away/home.
-                        if bl:  # we did get something back.
-                            bstr = "ml: {0}/{1} :: o/u: {2}".format(bl['awayml'], bl['homeml'], bl['total'])  # format betting part.
-                            ko = ircutils.mircColor('KICKOFF', 'green')  # ko part.
-                            # lets format the spread so it looks better.
-                            if not bl['spread'].startswith('-'):  # away favored.
-                                spread = "+{0}".format(bl['spread'])
-                            else:  # home favored.
-                                spread = "{0}".format(bl['spread'])
-                            mstr = "{0} v. {1}[{2}] :: {3} :: {4}".format(v['v'], v['h'], spread, bstr, ko)
-                        else:  # we did not get something back. post normal starting line.
-                            mstr = "{0} v. {1} :: {2}".format(v['v'], v['h'], ircutils.mircColor('KICKOFF', 'green'))
-                        # now post event.
-                        self._post(irc, mstr)
-                        # add event into scoredict now that we start.
-                        if k not in self.scoredict:
-                            self.scoredict[k] = {}
-                        else:
-                            self.log.error("checkfootball: GAME START :: {0} is already in scoredict".format(k))
-                    # GAME GOES TO HALFTIME.
-                    if ((v['q'] == "2") and (games2[k]['q'] == "H")):
-                        l = self._boldleader(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'])
-                        mstr = "{0} :: {1}".format(l, ircutils.mircColor('HALFTIME', 'yellow'))
-                        # now post event.
-                        self._post(irc, mstr)
-                    # GAME COMES OUT OF HALFTIME.
-                    if ((v['q'] == "H") and (games2[k]['q'] == "3")):
-                        l = self._boldleader(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'])
-                        s = ircutils.mircColor('Start of 3rd qtr', 'green')
-                        mstr = "{0} :: {1}".format(l, s)
-                        # now post event.
-                        self._post(irc, mstr)
-                    # START OF 2ND/4TH QUARTER.
-                    if (((v['q'] == "1") and (games2[k]['q'] == "2")) or ((v['q'] == "3") and (games2[k]['q'] == "4"))):
-                        self.log.info("Should fire start of 2nd or 4th qtr in {0}".format(k))
-                        l = self._boldleader(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'])
-                        q = "Start of {0} qtr".format(self._qtr(games2[k]['q']))
-                        mstr = "{0} :: {1}".format(l, ircutils.mircColor(q, 'green'))
-                        # now post event.
-                        self._post(irc, mstr)
-                    # GAME GOES INTO OVERTIME.
-                    if ((v['q'] == "4") and (games2[k]['q'] == "5")):
-                        self.log.info("Should fire overtime in {0}".format(k))
-                        mstr = "{0} {1} {2} {3} :: {4}".format(games2[k]['v'], games2[k]['vs'], games2[k]['h'], games2[k]['hs'], ircutils.bold("Overtime"))
-                        # now post event.
-                        self._post(irc, mstr)
+            if k not in changes:
+                continue
+            for (fields, rule) in self.rules:
+                if changes[k] & fields:
+                    rule(irc, k, v, games2[k])
 
         # BEFORE WE'RE DONE, CHECK FOR BIG PLAYS.
         if len(self.bps) != 0:  # we have events.
             #self.log.info("We have {0} items in self.bps".format(len(self.bps)))
             for f, b in self.bps.items():  # iterate over the events. f = eventid b = dict of bps item.
                 #self.log.info("Processing {0} in self.bps".format(f))
-                if f not in self.bpsdupe:  # make sure we have NOT printed this before.
+                q = b['eid']  # b['eid'] will mate up with k's in games1/games2.
+                if q not in games2:  # game is gone from the scorestrip.
+                    del self.bps[f]
+                elif not self.bpsdupe.seen(q, f):  # make sure we have NOT printed this before.
                     #self.log.info("{0} is not in self.bpsdupe so I should try and print it.".format(f))
                     # self.bps[bpsid] = {'eid': eid, 'team': team, 'play': play}
-                    q = b['eid']  # b['eid'] will mate up with k's in games1/games2.
-                    l = self._boldleader(games2[q]['v'], games2[q]['vs'], games2[q]['h'], games2[q]['hs'])  # create initial string.
+                    l = self._boldleader(games2[q].v, games2[q].vs, games2[q].h, games2[q].hs)  # create initial string.
                     bp = ircutils.bold("BIG PLAY ALERT")  # bold the alert text.
                     mstr = "{0} :: {1} :: {2} :: {3}".format(l, bp, b['team'], b['play'])  # output string.
                     # now post event.
-                    self._post(irc, mstr)
+                    self._post(irc, mstr, 'bigplay', teams=(games2[q].v, games2[q].h))
                     # now lets delete this from self.bps and add it to self.bpsdupe set.
                     del self.bps[f]
-                    self.bpsdupe.add(f)
+                    self.bpsdupe.add(q, f)
+                else:  # already printed.
+                    del self.bps[f]
 
         # done processing active event things.
-        # we now need to figure out when to next process.
+        # forget about games that fell off the scorestrip and anything that is too old.
+        for k in games1:
+            if k not in games2:
+                self.scoredupe.purge(k)
+                self.bpsdupe.purge(k)
+                self.gamestats.pop(k, None)
+        self.scoredupe.expire()
+        self.bpsdupe.expire()
         self.games = games2  # reset games.
-        # now we have to process gamestatuses to figure out what to do. uniq of gamestatuses.
-        gamestatuses = set([z['q'] for (i, z) in games2.items()])
-        # possible statuses: F/FO = game over, P = pending, H = halftime. Rest are active games.
-        if __builtins__['any'](z in ("1", "2", "3", "4", "5", "H") for z in gamestatuses):
-            self.nextcheck = None  # reset nextcheck.
-        else:  # we're here if there are NO active games.
-            utcnow = self._utcnow()  # grab UTCnow.
-            if 'P' in gamestatuses:  # we have pending games left in here.
-                self.log.info("checkfootball: only pending games.")
-                firstgametime = sorted([f['start'] for (i, f) in games2.items() if f['q'] == "P"])[0]  # sort, first item.
-                if utcnow < firstgametime:  # make sure these are not stale. this means firstgametime = future.
-                    self.log.info("checkfootball: firstgametime is {0}s in the future.".format(abs(utcnow-firstgametime)))
-                    self.nextcheck = firstgametime  # set our nextcheck to this time.
-                else:  # we're here if firstgametime is stale (in the past)
-                    self.log.info("checkfootball: first gametime is {0}s in the past.".format(abs(utcnow-firstgametime)))
-                    fgtdiff = firstgametime-utcnow  # get the diff.
-                    if (fgtdiff < 3601):  # it's under an hour old. carry on.
-                        self.nextcheck = None
-                        self.log.info("checkfootball: first gametime is in the past but under 1hr so we resume normal ops.")
-                    else:  # older than an hour. lets holdoff for 5m.
-                        self.nextcheck = utcnow+300
-                        self.log.info("checkfootball: first gametime is in the past over an hour so we hold off for 5m.")
-            else:  # we're here if there are NO active games and NO future games. I assume all games are final then.
-                self.log.info("checkfootball: no active games and no future games. holding off for an hour.")
-                self.nextcheck = utcnow+3600  # hold off for one hour.
+        # we now need to figure out when to next process.
+        (secs, self.nextreason) = self._nextinterval(games2)
+        self.nextcheck = self._utcnow()+secs
     #    self.log.info("Done running.")
     #checkfootball = wrap(checkfootball)
 
@@ -5,14 +5,466 @@
 #
 ###
 
+import os
+import time
+import pickle
+import shutil
+import tempfile
+import threading
+import SocketServer
+import BaseHTTPServer
 from supybot.test import *
 from supybot.commands import *
+import supybot.schedule as schedule
+from . import plugin
+
+def game(q, vs=0, hs=0, secs=None, rz=False, p=None, eid='2014091400', v='MIA', h='BUF'):
+    """A GameState as the scorestrip would give it to us."""
+
+    attrs = {'eid': eid, 'q': q, 'v': v, 'h': h, 'vs': str(vs), 'hs': str(hs), 'rz': "1" if rz else "0", 'p': p or ""}
+    if secs is not None:
+        attrs['k'] = "{0}:{1:02d}".format(secs // 60, secs % 60)
+    return plugin.GameState(attrs, 0, secs)
+
+class FakeIrc(object):
+    """Collects what the plugin sends, without formatting."""
+
+    def __init__(self):
+        self.lines = []
+        self.sent = []  # (channel, line).
+
+    def queueMsg(self, msg):
+        self.lines.append(ircutils.stripFormatting(msg.args[1]))
+        self.sent.append((msg.args[0], self.lines[-1]))
 
 class FootballTestCase(ChannelPluginTestCase):
     plugins = ('Football',)
 
+    def _setup(self):
+        """The plugin with one channel that gets everything and nothing waiting."""
+
+        cb = self.irc.getCallback('Football')
+        cb.ready.wait(30)
+        (cb.channels, cb.subs, cb.outbox, cb.buckets, cb.scorepending, cb.bps) = ({'#fb': 1}, {}, {}, {}, {}, {})
+        cb._invalidateout()
+        return cb
+
+    def _check(self, cb, games1, games2, scev=None):
+        """One checkfootball tick from games1 to games2, with scev as every game's latest
+        scoring play. Returns the lines it sent."""
+
+        irc = FakeIrc()
+        cb.games = games1
+        (cb._fetchgames, cb._scoreevent, cb._finalstats) = (lambda: games2, lambda gid: scev, lambda gid: None)
+        try:
+            with conf.supybot.plugins.Football.floodBurst.context(100):
+                cb.checkfootball(irc)
+                cb._flush(irc)
+        finally:
+            del cb._fetchgames, cb._scoreevent, cb._finalstats
+        return irc.lines
+
     def testFootball(self):
         self.assertResponse('footballchannel add #test', "I have enabled FOOTBALL status updates on #test") #, 'I have added SEC into #test')
         self.assertResponse('footballchannel del #test', "I have successfully removed #test") #, 'I have added SEC into #test')
 
+    def testFootballTeams(self):
+        self.assertNotError('footballchannel add #test')
+        self.assertResponse('footballteams', "#test gets teams: all")
+        self.assertResponse('footballevents', "#test gets events: all")
+
+    def testEvents(self):
+        cb = self._setup()
+        # (last tick, this tick, the one line it should post).
+        cases = [(game('P'), game('1', secs=900), " :: KICKOFF"),
+                 (game('1', secs=20), game('2', secs=900), "MIA 0 BUF 0 :: Start of 2nd qtr"),
+                 (game('2', secs=130), game('2', secs=115), "MIA 0 BUF 0 :: 2 minute warning. (2nd qtr 1:55)"),
+                 (game('2', secs=5), game('H'), "MIA 0 BUF 0 :: HALFTIME"),
+                 (game('H'), game('3', secs=900), "MIA 0 BUF 0 :: Start of 3rd qtr"),
+                 (game('3', secs=400, p='MIA'), game('3', secs=380, rz=True, p='MIA'), "MIA 0 BUF 0 :: MIA is in the redzone (3rd 6:20)"),
+                 (game('3', secs=20), game('4', secs=900), "MIA 0 BUF 0 :: Start of 4th qtr"),
+                 (game('4', 7, 7, secs=121), game('4', 7, 7, secs=120), "MIA 7 BUF 7 :: 2 minute warning. (4th qtr 2:00)"),
+                 (game('4', 7, 7, secs=1), game('5', 7, 7, secs=600), "MIA 7 BUF 7 :: Overtime"),
+                 (game('4', 10, 7, secs=1), game('F', 10, 7), "MIA 10 BUF 7 :: F"),
+                 (game('5', 10, 7, secs=1), game('FO', 10, 7), "MIA 10 BUF 7 :: F/OT")]
+        for (old, new, line) in cases:
+            lines = self._check(cb, {old.eid: old}, {new.eid: new})
+            self.assertEqual(len(lines), 1, (old.q, new.q, lines))
+            self.assertTrue(lines[0].endswith(line), (lines[0], line))
+        # games that did not change anything the rules look at run none of them.
+        calls = []
+        rules = cb.rules
+        cb.rules = tuple((fields, (lambda rule: lambda irc, k, old, new: calls.append((k, rule.__name__)))(rule)) for (fields, rule) in rules)
+        try:
+            games1 = {'a': game('3', secs=400, eid='a'), 'b': game('2', secs=300, eid='b'), 'c': game('H', eid='c')}
+            games2 = {'a': game('3', secs=380, eid='a'), 'b': game('2', secs=100, eid='b'), 'c': game('3', secs=900, eid='c')}
+            self._check(cb, games1, games2)
+            self.assertEqual(sorted(calls), [('b', '_evtwominute'), ('c', '_evstatus'), ('c', '_evtwominute')])
+        finally:
+            cb.rules = rules
+
+    def testRouting(self):
+        cb = self._setup()
+        cb.channels = {'#pats': 1, '#scores': 1, '#off': 0}
+        cb.subs = {'#pats': (frozenset(['NE']), frozenset()),  # everything about NE.
+                   '#scores': (frozenset(), frozenset(['score'])),  # every score.
+                   '#off': (frozenset(['DAL']), frozenset())}  # disabled.
+        cb._invalidateout()
+        irc = FakeIrc()
+        cb._post(irc, "NE 7 NYJ 0 :: TD", 'score', teams=('NE', 'NYJ'))
+        cb._post(irc, "NE 7 NYJ 0 :: HALFTIME", 'status', teams=('NE', 'NYJ'))
+        cb._post(irc, "MIA 3 BUF 0 :: FG", 'score', teams=('MIA', 'BUF'))
+        cb._post(irc, "MIA 3 BUF 0 :: HALFTIME", 'status', teams=('MIA', 'BUF'))
+        cb._post(irc, "DAL 0 TEN 0 :: HALFTIME", 'status', teams=('DAL', 'TEN'))
+        cb._flush(irc)
+        self.assertEqual(sorted(irc.sent), [('#pats', "NE 7 NYJ 0 :: HALFTIME"), ('#pats', "NE 7 NYJ 0 :: TD"),
+                                            ('#scores', "MIA 3 BUF 0 :: FG"), ('#scores', "NE 7 NYJ 0 :: TD")])
+        # and what checkfootball bothers to fetch for.
+        self.assertTrue(cb._wanted(game('4', v='NE', h='NYJ'), 'redzone'))
+        self.assertTrue(cb._wanted(game('4', v='MIA', h='BUF'), 'score'))
+        self.assertFalse(cb._wanted(game('4', v='MIA', h='BUF'), 'finalstats'))
+        cb.subs['#scores'] = (frozenset(['NE']), frozenset(['score']))
+        cb._invalidateout()
+        self.assertFalse(cb._wanted(game('4', v='DAL', h='TEN'), 'score'))  # nobody follows DAL.
+        # so a score there is not even fetched.
+        self.assertEqual(self._check(cb, {'g': game('4', 0, 0, 300, eid='g', v='DAL', h='TEN')},
+                                     {'g': game('4', 0, 3, 200, eid='g', v='DAL', h='TEN')},
+                                     {'id': '1', 'team': 'TEN', 'type': 'FG', 'desc': 'TEN FG', 'qtr': 4}), [])
+        self.assertFalse(cb.scoredupe.seen('g', '1'))
+
+    def testScoreGate(self):
+        cb = self.irc.getCallback('Football')
+        cb.ready.wait(30)  # _warmup restores scorepending.
+        class Clock(object):
+            t = 1000
+            def now(self):
+                return self.t
+        (source, cb.source) = (cb.source, Clock())
+        try:
+            cb.scorepending = {}
+            window = cb.registryValue('scoreRetryWindow')
+            games = {'a': game('3', eid='a'), 'b': game('3', eid='b')}
+            # TD late in the 2nd with no PAT yet. still picked at halftime.
+            self.assertEqual(cb._scoregate(games, {'a': set(['score', 'q'])}), ['a'])
+            cb.source.t += 60
+            self.assertEqual(cb._scoregate(games, {}), ['a'])
+            # a score on the H->3 tick counts too.
+            self.assertEqual(sorted(cb._scoregate(games, {'b': set(['score', 'q'])})), ['a', 'b'])
+            # then the window runs out.
+            cb.source.t += window - 30
+            self.assertEqual(cb._scoregate(games, {}), ['b'])
+            # and games that fell off the scorestrip go.
+            self.assertEqual(cb._scoregate({'a': games['a']}, {}), [])
+            self.assertEqual(cb.scorepending, {})
+        finally:
+            cb.source = source
+
+    def testScoreAfterFinal(self):
+        cb = self._setup()
+        gid = '2014091400'
+        fg = {'id': '1', 'team': 'MIA', 'type': 'FG', 'desc': 'MIA FG', 'qtr': 4}
+        cb.scoredupe.add(gid, '1')  # posted a while back.
+        # BUF scores but game-center still has the FG as the last play.
+        self.assertEqual(self._check(cb, {gid: game('4', 3, 0, 300)}, {gid: game('4', 3, 3, 200)}, fg), [])
+        # then the game ends with the document still behind.
+        self.assertEqual(self._check(cb, {gid: game('4', 3, 3, 200)}, {gid: game('F', 3, 3)}, fg), ["MIA 3 BUF 3 :: F"])
+        self.assertTrue(cb.scoredupe.seen(gid, '1'))
+        self.assertEqual(self._check(cb, {gid: game('F', 3, 3)}, {gid: game('F', 3, 3)}, fg), [])  # no repeat.
+        # forgotten once we stop waiting.
+        cb.scorepending[gid] = time.time() - 1
+        self.assertEqual(self._check(cb, {gid: game('F', 3, 3)}, {gid: game('F', 3, 3)}, fg), [])
+        self.assertFalse(cb.scoredupe.seen(gid, '1'))
+
+    def testFlush(self):
+        cb = self.irc.getCallback('Football')
+        cb.ready.wait(30)
+        irc = FakeIrc()
+        (cb.channels, cb.subs, cb.outbox, cb.buckets) = ({'#fb': 1}, {}, {}, {})
+        cb._invalidateout()
+        settings = conf.supybot.plugins.Football
+        with settings.floodBurst.context(3):
+            with settings.floodInterval.context(60):
+                cb._post(irc, "NE @ NYJ :: HALFTIME", 'status', teams=('NE', 'NYJ'))
+                cb._post(irc, "MIA @ BUF :: KICKOFF", 'kickoff', ('KICKOFF', 'MIA @ BUF'), ('MIA', 'BUF'))
+                cb._post(irc, "DAL @ TEN :: KICKOFF", 'kickoff', ('KICKOFF', 'DAL @ TEN'), ('DAL', 'TEN'))
+                cb._post(irc, "SEA @ SD :: BIG PLAY", 'bigplay', teams=('SEA', 'SD'))
+                cb._post(irc, "DET @ CAR :: TOUCHDOWN", 'score', teams=('DET', 'CAR'))
+                cb._post(irc, "KC @ DEN :: REDZONE", 'redzone', teams=('KC', 'DEN'))
+                cb._flush(irc)
+                # scores first, then posting order within a priority. both kickoffs go out as one line.
+                self.assertEqual(irc.lines, ["DET @ CAR :: TOUCHDOWN", "NE @ NYJ :: HALFTIME",
+                                             "KICKOFF :: MIA @ BUF | DAL @ TEN"])
+                # the burst is used up so the rest waits.
+                self.assertEqual([e[4] for e in cb.outbox['#fb']], ["SEA @ SD :: BIG PLAY", "KC @ DEN :: REDZONE"])
+                cb._flush(irc)
+                self.assertEqual(len(irc.lines), 3)
+                # two intervals later there are two tokens.
+                cb.buckets['#fb'] = (0, time.time() - 120)
+                cb._flush(irc)
+                self.assertEqual(irc.lines[3:], ["SEA @ SD :: BIG PLAY", "KC @ DEN :: REDZONE"])
+                self.assertEqual(cb.outbox, {})
+
+    def testCronSurvives(self):
+        cb = self._setup()
+        cb.nextcheck = cb._utcnow() + 3600
+        def broken(*args):
+            raise ValueError("disk full")
+        tick = cb._tick
+        (cb.checkfootball, cb._savestate, cb._tick) = (lambda irc: cb._post(irc, "MIA @ BUF :: HALFTIME", 'status'), broken, broken)
+        try:
+            # bookkeeping blowing up is logged and the tick still sends what it has.
+            irc = FakeIrc()
+            tick(irc)
+            self.assertEqual(irc.lines, ["MIA @ BUF :: HALFTIME"])
+            # even if a whole tick does, the next one is scheduled.
+            if 'checkfootball' in schedule.schedule.events:  # startcron's.
+                schedule.removeEvent('checkfootball')
+            self.assertRaises(ValueError, cb._crontick, irc)
+            self.assertTrue('checkfootball' in schedule.schedule.events)
+        finally:
+            del cb.checkfootball, cb._savestate, cb._tick
+            try:
+                schedule.removeEvent('checkfootball')
+            except KeyError:
+                pass
+
+    def testPrefixCallbacks(self):
+        cb = self.irc.getCallback('Football')
+        mine = lambda value: [c for c in value._callbacks if getattr(c[0], 'im_self', None) is cb]
+        for value in cb.prefixvalues:
+            self.assertEqual(len(mine(value)), 1)
+            value.removeCallback(cb.prefixcb)  # what die does. nothing of ours is left behind.
+            self.assertEqual(mine(value), [])
+            value.addCallback(cb.prefixcb)
+
+    def testMigratePickle(self):
+        cb = self.irc.getCallback('Football')
+        cb.ready.wait(30)
+        filename = conf.supybot.directories.data.dirize(cb.name()+".pickle")
+        with open(filename, 'wb') as f:
+            pickle.dump({'channels': {'#old': 1}}, f)
+        try:
+            cb.state.put('migrated', False)
+            cb._loadstate()
+            self.assertEqual(cb.channels.get('#old'), 1)
+            self.assertEqual(cb.state.channels().get('#old'), 1)
+            self.assertTrue(cb.state.get('migrated'))
+            # only the once. a channel deleted since does not come back.
+            cb.state.delchannel('#old')
+            cb._loadstate()
+            self.assertFalse('#old' in cb.channels)
+        finally:
+            os.remove(filename)
+
+    def testWarmStart(self):
+        cb = self.irc.getCallback('Football')
+        cb.ready.wait(30)
+        saved = (cb.games, cb.gamesat, cb.scorepending, cb.bps, cb.nextcheck, cb.nextreason)
+        try:
+            (cb.games, cb.gamesat, cb.scorepending) = ({'2014091400': 'game'}, 1000, {'2014091400': 2000})
+            (cb.bps, cb.nextcheck, cb.nextreason) = ({'2014091400': ['1']}, 1500, 'live games')
+            cb._savestate()
+            (cb.games, cb.gamesat, cb.scorepending, cb.bps, cb.nextcheck, cb.nextreason) = (None, None, {}, {}, None, None)
+            self.assertTrue(cb._loadstate())
+            self.assertEqual((cb.games, cb.gamesat, cb.scorepending), ({'2014091400': 'game'}, 1000, {'2014091400': 2000}))
+            self.assertEqual((cb.bps, cb.nextcheck, cb.nextreason), ({'2014091400': ['1']}, 1500, 'live games'))
+            # too old to trust.
+            live = cb.state.get('live')
+            live['saved'] -= 601
+            cb.state.put('live', live)
+            cb.games = None
+            self.assertFalse(cb._loadstate())
+            self.assertEqual(cb.games, None)
+        finally:
+            (cb.games, cb.gamesat, cb.scorepending, cb.bps, cb.nextcheck, cb.nextreason) = saved
+            cb.state.put('live', None)
+
+    def testFootballStats(self):
+        # one reply per line. drain them until the cron line shows up.
+        replies = [self.getMsg('footballstats').args[1]]
+        deadline = time.time() + 5
+        while time.time() < deadline and not [r for r in replies if 'cron errors=' in r]:
+            m = self.irc.takeMsg()
+            if m:
+                replies.append(m.args[1])
+            else:
+                time.sleep(0.1)
+        self.assertTrue([r for r in replies if 'cron errors=0' in r], replies)
+
+class FootballHTTPPoolTestCase(SupyTestCase):
+    """Run HTTPPool against a local stand-in for the feed hosts."""
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.paths = paths = []
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive.
+            def do_GET(self):
+                paths.append(self.path)
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write('ok')
+            def log_message(self, *args):
+                pass
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        self.server = Server(('127.0.0.1', 0), Handler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.url = 'http://127.0.0.1:{0}/liveupdate/scorestrip/ss.xml'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        SupyTestCase.tearDown(self)
+
+    def testConnectionReuse(self):
+        pool = plugin.HTTPPool(2, 60, 5)
+        for i in range(3):
+            (status, info, body) = pool.request(self.url, {})
+            self.assertEqual(status, 200)
+            self.assertEqual(body, 'ok')
+        self.assertEqual(pool.stats['new'], 1)
+        self.assertEqual(pool.stats['reused'], 2)
+        pool.close()
+
+    def testIdleExpiry(self):
+        pool = plugin.HTTPPool(2, 0, 5)  # nothing survives being idle.
+        pool.request(self.url, {})
+        pool.request(self.url, {})
+        self.assertEqual(pool.stats['new'], 2)
+        self.assertEqual(pool.stats['expired'], 1)
+        pool.close()
+
+    def testProxy(self):
+        pool = plugin.HTTPPool(2, 60, 5)
+        proxy = '127.0.0.1:{0}'.format(self.server.server_port)  # stands in for the proxy too.
+        url = 'http://www.nfl.com/liveupdate/scorestrip/ss.xml'
+        for i in range(2):
+            (status, info, body) = pool.request(url, {}, proxy)
+            self.assertEqual(body, 'ok')
+        self.assertEqual(self.paths, [url, url])  # absolute urls, as a proxy wants.
+        self.assertEqual(pool.stats['reused'], 1)
+        pool.close()
+
+class FootballCircuitBreakerTestCase(SupyTestCase):
+
+    def testOpenProbeClose(self):
+        cb = plugin.CircuitBreaker(2, 30, 600)
+        e = ('gtd', '2014091400')
+        self.assertEqual(cb.failure(e, 1000), None)  # still closed.
+        self.assertTrue(cb.allow(e, 1000))
+        delay = cb.failure(e, 1000)  # opens.
+        self.assertTrue(15 <= delay <= 30)
+        self.assertFalse(cb.allow(e, 1001))
+        self.assertTrue(cb.allow(('gtd', '2014091401'), 1001))  # other games are fine.
+        self.assertTrue(cb.allow(e, 1031))  # half-open probe.
+        self.assertFalse(cb.allow(e, 1031))  # only one.
+        self.assertTrue(30 <= cb.failure(e, 1031) <= 60)  # probe failed. open longer.
+        self.assertTrue(cb.allow(e, 1100))
+        self.assertTrue(cb.success(e))
+        self.assertEqual(cb.opened(), [])
+
+class FootballDedupeStoreTestCase(SupyTestCase):
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.journal = []
+        self.store = plugin.DedupeStore(60, 3, lambda *args: self.journal.append(args))
+
+    def testExpire(self):
+        self.store.add('g1', 'a', 1000)
+        self.store.add('g1', 'b', 1030)
+        self.store.expire(1059)
+        self.assertEqual(len(self.store), 2)
+        self.store.expire(1060)  # a is ttl old.
+        self.assertFalse(self.store.seen('g1', 'a'))
+        self.assertTrue(self.store.seen('g1', 'b'))
+        self.assertEqual(self.store.stats['expired'], 1)
+        self.assertEqual(self.journal[-1], ('del', 'g1', 'a', 1000))
+
+    def testEvict(self):
+        for (i, key) in enumerate(['a', 'b', 'c', 'd']):
+            self.store.add('g1', key, 1000 + i)
+        self.store.add('g1', 'b', 2000)  # already there. no change.
+        self.assertFalse(self.store.seen('g1', 'a'))  # oldest goes first.
+        self.assertEqual(list(self.store.entries), [('g1', 'b'), ('g1', 'c'), ('g1', 'd')])
+        self.assertEqual(self.store.stats['evicted'], 1)
+        self.assertEqual(self.journal, [('add', 'g1', 'a', 1000), ('add', 'g1', 'b', 1001), ('add', 'g1', 'c', 1002),
+                                        ('add', 'g1', 'd', 1003), ('del', 'g1', 'a', 1000)])
+
+    def testPurge(self):
+        self.store.add('g1', 'a', 1000)
+        self.store.add('g2', 'a', 1000)
+        self.store.add('g1', 'b', 1000)
+        self.store.purge('g1')
+        self.assertEqual(list(self.store.entries), [('g2', 'a')])
+        self.assertEqual(self.store.stats['purged'], 2)
+        self.assertEqual(self.journal[-1], ('purge', 'g1', None, None))
+        self.store.purge('g3')  # nothing there. nothing journaled.
+        self.assertEqual(len(self.journal), 4)
+
+    def testLoad(self):
+        now = time.time()
+        self.store.load([('g1', 'b', now - 10), ('g1', 'a', now - 20), ('g1', 'old', now - 3600)])
+        self.assertEqual(list(self.store.entries), [('g1', 'a'), ('g1', 'b')])  # oldest first, stale dropped.
+
+class FootballStateStoreTestCase(SupyTestCase):
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'Football.db')
+        self.store = plugin.StateStore(self.filename, log)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir, True)
+        SupyTestCase.tearDown(self)
+
+    def reopen(self):
+        self.store.close()
+        self.store = plugin.StateStore(self.filename, log)
+
+    def testChannels(self):
+        self.store.setchannel('#a', 1)
+        self.store.setchannel('#b', 1)
+        self.store.setsubscriptions('#a', set(['NE', 'BUF']), set(['score']))
+        self.store.setchannel('#a', 0)  # turning it off keeps what it subscribed to.
+        self.store.delchannel('#b')
+        self.reopen()
+        self.assertEqual(self.store.channels(), {'#a': 0})
+        self.assertEqual(self.store.subscriptions(), {'#a': (frozenset(['NE', 'BUF']), frozenset(['score']))})
+
+    def testDedupe(self):
+        dedupe = plugin.DedupeStore(3600, 2, lambda *args: self.store.dedupe('score', *args))
+        now = time.time()
+        for key in ('a', 'b', 'c'):  # a is evicted.
+            dedupe.add('g1', key, now)
+        dedupe.add('g2', 'a', now)  # so is b.
+        dedupe.purge('g1')
+        self.reopen()
+        self.assertEqual(self.store.loaddedupe('score'), [('g2', 'a', now)])
+        self.assertEqual(self.store.loaddedupe('bps'), [])
+
+    def testValues(self):
+        self.store.put('live', {'games': {'2014091400': 1}})
+        self.reopen()
+        self.assertEqual(self.store.get('live'), {'games': {'2014091400': 1}})
+        self.assertEqual(self.store.get('missing', 'default'), 'default')
+
+class FootballGameStatsTestCase(SupyTestCase):
+
+    def testLeaders(self):
+        rushing = dict((str(i), {'name': u'RB{0}'.format(i), 'yds': y, 'att': 10, 'tds': 0}) for (i, y) in enumerate([40, 120, 7, 95, 60]))
+        side = lambda abbr: {'abbr': abbr, 'stats': {'rushing': rushing, 'team': {'trnovr': 1, 'totyds': 300, 'totfd': 18, 'top': '30:00'}}}
+        stats = plugin.GameStats({'away': side('NE'), 'home': side('NYJ')}, 0, n=3)
+        self.assertEqual([p['yds'] for p in stats.sides['home']['leaders']['rushing']], [120, 95, 60])
+        self.assertEqual(stats.line('home', 'rushing'), "RB1 YDS: 120 ATT: 10 TD: 0")
+        self.assertEqual(stats.side('NE'), 'away')
+        self.assertEqual(stats.totals('away'), "TO: 1 YDS: 300 FD: 18 TOP: 30:00")
+        self.assertRaises(IndexError, stats.line, 'away', 'passing')
+
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: